@@ -1,51 +1,185 @@
 # SWDV 630 - Object-Oriented Software Architecture
 # Account class for use with Guest class in person.py
 
-from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import ForeignKey, select, func
+from sqlalchemy.orm import Mapped, WriteOnlyMapped, mapped_column, relationship
 from base import Base
 
+# A snapshot of the balances is appended after every SNAPSHOT_INTERVAL transactions
+SNAPSHOT_INTERVAL = 100
+
+def to_cents(amount):
+    """Converts a dollar amount to integer cents, rounding half up"""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+class AccountTransaction(Base):
+    """Append-only ledger entry holding the change in amount due and credits, in cents"""
+
+    def __init__(self, kind, due_cents=0, credit_cents=0):
+        self._kind = kind
+        self._due_cents = due_cents
+        self._credit_cents = credit_cents
+        self._created = datetime.now()
+
+    __tablename__ = 'account_transaction'
+
+    _id: Mapped[int] = mapped_column(primary_key=True)
+    _account_id: Mapped[int] = mapped_column(ForeignKey('account._id'), index=True)
+    _kind: Mapped[str]
+    _due_cents: Mapped[int]
+    _credit_cents: Mapped[int]
+    _created: Mapped[datetime]
+
+    def get_kind(self):
+        return self._kind
+
+    def get_due_cents(self):
+        return self._due_cents
+
+    def get_credit_cents(self):
+        return self._credit_cents
+
+    def __repr__(self):
+        return f'<(AccountTransaction) {self._kind}: Due {self._due_cents:+}c, Credits {self._credit_cents:+}c>'
+
+class AccountSnapshot(Base):
+    """Balances of an account after a number of ledger transactions"""
+
+    def __init__(self, transaction_count, due_cents, credit_cents):
+        self._transaction_count = transaction_count
+        self._due_cents = due_cents
+        self._credit_cents = credit_cents
+        self._created = datetime.now()
+
+    __tablename__ = 'account_snapshot'
+
+    _id: Mapped[int] = mapped_column(primary_key=True)
+    _account_id: Mapped[int] = mapped_column(ForeignKey('account._id'), index=True)
+    _transaction_count: Mapped[int]
+    _due_cents: Mapped[int]
+    _credit_cents: Mapped[int]
+    _created: Mapped[datetime]
+
 class Account(Base):
-    """Account class for hotel management system"""
-    
+    """
+    Account class for hotel management system. Every change is appended to the
+    account_transaction ledger, while the balances are kept in integer cents on
+    the account row so reading them never touches the ledger.
+    """
+
     def __init__(self, charge=0.0, credits=0.0):
-        self._total_due = float(charge)
-        self._credits = float(credits)
+        self._total_due_cents = 0
+        self._credits_cents = 0
+        self._transaction_count = 0
+
+        if charge or credits:
+            self._record('open', to_cents(charge), to_cents(credits))
 
     __tablename__ = 'account'
 
     _id: Mapped[int] = mapped_column(primary_key=True)
-    _total_due: Mapped[float]
-    _credits: Mapped[float]
+    _total_due_cents: Mapped[int] = mapped_column(default=0)
+    _credits_cents: Mapped[int] = mapped_column(default=0)
+    _transaction_count: Mapped[int] = mapped_column(default=0)
+    _transactions: WriteOnlyMapped[AccountTransaction] = relationship(cascade='all, delete-orphan')
+    _snapshots: WriteOnlyMapped[AccountSnapshot] = relationship(cascade='all, delete-orphan')
 
     def get_total_due(self):
-        return self._total_due
-    
+        return self._total_due_cents / 100
+
     def get_credits(self):
-        return self._credits
-    
+        return self._credits_cents / 100
+
+    def get_transactions(self, session):
+        """Returns the ledger transactions of the account in the order they were made"""
+        return session.scalars(self._transactions.select().order_by(AccountTransaction._id)).all()
+
     def credit(self, amt):
-        self._credits += amt
+        self._record('credit', 0, to_cents(amt))
 
     def charge(self, amt):
-        self._total_due += amt
+        self._record('charge', to_cents(amt), 0)
 
     def pay(self, payment, credits=0):
-        self._total_due -= (payment + credits)
-        self._credits -= credits
+        credits = to_cents(credits)
+        self._record('payment', -(to_cents(payment) + credits), -credits)
 
     def apply_credits(self):
-        credits = self.get_credits()
-        self._total_due -= credits
-
-        total = self.get_total_due()
-        if total < 0:
-            self._credits = abs(total)
-            self._total = 0
-        else:
-            self._credits = 0
+        # Credits beyond the amount due are kept as credits
+        applied = min(self._credits_cents, max(self._total_due_cents, 0))
+        self._record('apply_credits', -applied, -applied)
 
     def payment_due(self):
         return self.get_total_due() > 0
-    
+
+    def rebuild(self, session):
+        """Recomputes the balances from the ledger with a single aggregate query"""
+        stmt = select(
+            func.coalesce(func.sum(AccountTransaction._due_cents), 0),
+            func.coalesce(func.sum(AccountTransaction._credit_cents), 0),
+            func.count(),
+        ).where(AccountTransaction._account_id == self._id)
+
+        self._total_due_cents, self._credits_cents, self._transaction_count = session.execute(stmt).one()
+
+    def _record(self, kind, due_cents, credit_cents):
+        """Appends a ledger transaction and applies it to the balances"""
+        if not due_cents and not credit_cents:
+            return
+
+        self._transactions.add(AccountTransaction(kind, due_cents, credit_cents))
+        self._total_due_cents += due_cents
+        self._credits_cents += credit_cents
+        self._transaction_count += 1
+
+        if self._transaction_count % SNAPSHOT_INTERVAL == 0:
+            self._snapshots.add(AccountSnapshot(self._transaction_count, self._total_due_cents, self._credits_cents))
+
     def __repr__(self):
-        return f'<(Account) Due: ${self.get_total_due():0.2f}, Credits: ${self.get_credits():0.2f}>'
\ No newline at end of file
+        return f'<(Account) Due: ${self.get_total_due():0.2f}, Credits: ${self.get_credits():0.2f}>'
+
+def test():
+    from utils import get_session
+
+    session = get_session()
+    account = Account()
+    session.add(account)
+
+    for _ in range(3):
+        account.charge(0.1)
+    print(account.get_total_due())             # -> 0.3
+
+    account.credit(0.5)
+    account.apply_credits()
+    print(account)                             # -> <(Account) Due: $0.00, Credits: $0.20>
+
+    account.charge(150)
+    account.pay(100, 0.2)
+    print(account)                             # -> <(Account) Due: $49.80, Credits: $0.00>
+    session.commit()
+
+    print(len(account.get_transactions(session)))  # -> 7
+    account._total_due_cents = 0
+    account.rebuild(session)
+    print(account.get_total_due())             # -> 49.8
+
+    for _ in range(SNAPSHOT_INTERVAL):
+        account.charge(1)
+    session.commit()
+    print(session.scalar(select(func.count()).select_from(AccountSnapshot)))  # -> 1
+
+    # Bulk saving also inserts the pending ledger transactions
+    account = Account(25)
+    account.charge(10)
+    print(Base.save_all([account], session, bulk=True)['rows'])  # -> 3
+    session.add(account)
+    account.rebuild(session)
+    print(account.get_total_due(), len(account.get_transactions(session)))  # -> 35.0 2
+    session.commit()
+    print(len(account.get_transactions(session)))  # -> 2
+
+    session.close()
+
+if __name__ == '__main__': test()
@@ -114,12 +114,7 @@ def main():
     room_2.set_rate(130)
     print(room_2.get_rate())    # -> 130
 
-    for i in range(4, 16):
-        new_room = room_factory.get('queen')
-        new_room.set_room_number(i)
-        data.append(new_room)
-
-    Base.save_all(data, session)
+    room_factory.provision('queen', range(4, 16), session)
     Room.set_type_rate('queen', 90, session)
 
     print(room_1.get_rate())    # -> 90
@@ -0,0 +1,219 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Index structures for room availability lookups
+
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+class IntervalIndex:
+    """
+    Sorted index of half-open [start, end) intervals keyed by their start.
+    Lookups use bisect on the sorted starts plus a running maximum of the ends,
+    so checking whether a point is covered costs O(log n).
+    """
+
+    def __init__(self, intervals=()):
+        pairs = sorted(dict(intervals).items())
+        self._starts = [start for start, end in pairs]
+        self._ends = [end for start, end in pairs]
+        self._max_ends = []
+        self._update_max_ends(0)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __contains__(self, start):
+        idx = bisect_left(self._starts, start)
+        return idx < len(self._starts) and self._starts[idx] == start
+
+    def add(self, start, end):
+        """Adds the interval [start, end), replacing any interval with the same start"""
+        idx = bisect_left(self._starts, start)
+
+        if idx < len(self._starts) and self._starts[idx] == start:
+            self._ends[idx] = end
+        else:
+            self._starts.insert(idx, start)
+            self._ends.insert(idx, end)
+
+        self._update_max_ends(idx)
+
+    def remove(self, start):
+        """Removes the interval beginning at start, raises KeyError if there is none"""
+        idx = bisect_left(self._starts, start)
+
+        if idx == len(self._starts) or self._starts[idx] != start:
+            raise KeyError(start)
+
+        del self._starts[idx]
+        del self._ends[idx]
+        self._update_max_ends(idx)
+
+    def covers(self, point):
+        """Returns True if point falls inside any interval (start <= point < end)"""
+        idx = bisect_right(self._starts, point) - 1
+        return idx >= 0 and self._max_ends[idx] > point
+
+    def _update_max_ends(self, idx):
+        """Recomputes the running maximum of the ends from position idx onward"""
+        del self._max_ends[idx:]
+        current = self._max_ends[-1] if self._max_ends else None
+
+        for end in self._ends[idx:]:
+            if current is None or end > current:
+                current = end
+            self._max_ends.append(current)
+
+class NightCalendar:
+    """
+    Compact calendar of the unavailable nights of one room. Nights are counted
+    from an epoch date and stored one bit each in a bytearray, so two years take
+    about 92 bytes, and the ranges are kept as parallel arrays of start nights
+    and lengths so they can be removed again.
+
+    A range [start, end) occupies the nights from start.date() up to but not
+    including end.date(), with a minimum of one night. available_on follows
+    Room.available_on at the resolution of whole nights. Nights before the epoch
+    hold no ranges, so they are always available.
+    """
+
+    __slots__ = ('_epoch', '_bits', '_starts', '_lengths')
+
+    def __init__(self, epoch, ranges=()):
+        self._epoch = _ordinal(epoch)
+        self._bits = bytearray()
+        self._starts = array('i')
+        self._lengths = array('H')
+
+        for start, end in ranges:
+            self.add_unavailable(start, end)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def get_epoch(self):
+        return date.fromordinal(self._epoch)
+
+    def get_unavailable_nights(self):
+        """Returns a dict mapping the first night of each range to its number of nights"""
+        return {date.fromordinal(self._epoch + start): length for start, length in zip(self._starts, self._lengths)}
+
+    def add_unavailable(self, start, end):
+        """Marks the nights of [start, end) as unavailable, replacing any range that starts on the same night"""
+        first, last = self._nights(start, end)
+        idx = bisect_left(self._starts, first)
+
+        if idx < len(self._starts) and self._starts[idx] == first:
+            self._clear(idx)
+            self._lengths[idx] = last - first
+        else:
+            self._starts.insert(idx, first)
+            self._lengths.insert(idx, last - first)
+
+        self._set_bits(first, last, True)
+
+    def remove_unavailable(self, start):
+        """Removes the range starting on the night of start, raises KeyError if there is none"""
+        first = self._night(start)
+        idx = bisect_left(self._starts, first)
+
+        if idx == len(self._starts) or self._starts[idx] != first:
+            raise KeyError(start)
+
+        self._clear(idx)
+        del self._starts[idx]
+        del self._lengths[idx]
+
+    def available_on(self, start_date, end_date=None):
+        if self.is_occupied(start_date):
+            return False
+
+        if end_date and self.is_occupied(end_date):
+            return False
+
+        return True
+
+    def is_occupied(self, day):
+        """Returns True if the night of day is unavailable"""
+        night = _ordinal(day) - self._epoch
+        return 0 <= night and night // 8 < len(self._bits) and bool(self._bits[night // 8] >> (night % 8) & 1)
+
+    def is_free(self, start, end):
+        """Returns True if every night of [start, end) is available"""
+        first = _ordinal(start) - self._epoch
+        last = max(_ordinal(end) - self._epoch, first + 1)
+        if last <= 0:
+            return True
+
+        return not self._range_mask(max(first, 0), last)
+
+    def _clear(self, idx):
+        """Clears the nights of the range at idx, then sets them again for any other range sharing them"""
+        first = self._starts[idx]
+        last = first + self._lengths[idx]
+        self._set_bits(first, last, False)
+
+        for other in range(len(self._starts)):
+            other_first = self._starts[other]
+            if other_first >= last: break
+
+            other_last = other_first + self._lengths[other]
+            if other != idx and other_last > first:
+                self._set_bits(max(first, other_first), min(last, other_last), True)
+
+    def _set_bits(self, first, last, value):
+        if last > len(self._bits) * 8:
+            self._bits.extend(bytes((last + 7) // 8 - len(self._bits)))
+
+        mask = ((1 << (last - first)) - 1) << (first % 8)
+        lo, hi = first // 8, (last + 7) // 8
+        current = int.from_bytes(self._bits[lo:hi], 'little')
+        current = current | mask if value else current & ~mask
+        self._bits[lo:hi] = current.to_bytes(hi - lo, 'little')
+
+    def _range_mask(self, first, last):
+        """Returns the occupied bits of nights [first, last), shifted down to bit 0"""
+        lo, hi = first // 8, (last + 7) // 8
+        current = int.from_bytes(self._bits[lo:hi], 'little') >> (first % 8)
+        return current & ((1 << (last - first)) - 1)
+
+    def _night(self, day):
+        night = _ordinal(day) - self._epoch
+        if night < 0:
+            raise ValueError('Date is before the calendar epoch')
+        return night
+
+    def _nights(self, start, end):
+        first = self._night(start)
+        return first, max(self._night(end), first + 1)
+
+def _ordinal(day):
+    if hasattr(day, 'date'):
+        day = day.date()
+    return day.toordinal()
+
+def test():
+    from datetime import datetime
+
+    index = IntervalIndex({datetime(2023, 8, 10): datetime(2023, 8, 12)})
+    index.add(datetime(2023, 8, 1), datetime(2023, 8, 5))
+
+    print(index.covers(datetime(2023, 8, 3)))     # -> True
+    print(index.covers(datetime(2023, 8, 5)))     # -> False
+    print(index.covers(datetime(2023, 8, 11)))    # -> True
+
+    index.remove(datetime(2023, 8, 10))
+    print(index.covers(datetime(2023, 8, 11)))    # -> False
+    print(len(index))                             # -> 1
+
+    calendar = NightCalendar(date(2023, 1, 1), [(datetime(2023, 8, 1), datetime(2023, 8, 5))])
+    calendar.add_unavailable(datetime(2023, 8, 4), datetime(2023, 8, 8))
+    print(calendar.available_on(datetime(2023, 8, 5)))    # -> False
+
+    calendar.remove_unavailable(datetime(2023, 8, 4))
+    print(calendar.available_on(datetime(2023, 8, 5)))    # -> True
+    print(calendar.is_occupied(datetime(2023, 8, 4)))     # -> True
+    print(calendar.is_free(datetime(2023, 8, 5), datetime(2023, 9, 1)))  # -> True
+    print(calendar.available_on(datetime(2022, 12, 1)), calendar.is_free(datetime(2022, 12, 1), datetime(2023, 8, 2)))  # -> True False
+
+if __name__ == '__main__': test()
@@ -1,23 +1,148 @@
 # SWDV 630 - Object-Oriented Software Architecture
 # base class for mapping classes with the SQLAlchemy ORM
 
-from sqlalchemy import select
-from sqlalchemy.orm import DeclarativeBase
+from time import perf_counter
+from collections import namedtuple
+from sqlalchemy import select, insert, update, inspect, tuple_
+from sqlalchemy.orm import DeclarativeBase, make_transient_to_detached
+from sqlalchemy.orm.interfaces import ONETOMANY, MANYTOONE
+
+# Relationship loading strategies whose collections are never held in memory
+WRITE_ONLY = ('write_only', 'dynamic')
 
 class Base(DeclarativeBase):
     """SQLAlchemy base class"""
-    
+
     def save(self, session):
         """Saves the instance to database connected to session"""
         session.add(self)
         session.commit()
 
     @staticmethod
-    def save_all(lst, session):
-        """Saves all instances in lst to database connected to session"""
-        for obj in lst:
-            session.add(obj)
+    def save_all(lst, session, bulk=False, batch_size=1000, chunk_commit=False):
+        """
+        Saves all instances in lst to database connected to session.
+
+        With bulk=True the instances are grouped by class and written with
+        executemany INSERT batches of batch_size rows, committing after every
+        batch if chunk_commit is True. Bulk mode only writes the instances in lst
+        (relationships are not cascaded), but foreign keys are filled in from
+        related instances saved in the same call. Keys to instances inserted later
+        in the call, such as an employee saved before its manager in the shared
+        person table, are set with a follow-up UPDATE, and a ValueError is raised
+        for a many-to-one relation to an instance that is not saved. Instances added
+        to write-only collections (e.g. an account's ledger transactions) are
+        inserted right after their parent. Saved instances are left detached, so
+        they can be added to a session later for updates.
+
+        Returns a dict with the number of rows saved, the elapsed seconds and rows per second.
+        """
+        began = perf_counter()
+
+        if bulk:
+            rows = Base._bulk_insert(lst, session, batch_size, chunk_commit)
+        else:
+            rows = 0
+            for obj in lst:
+                session.add(obj)
+                rows += 1
+
         session.commit()
+        seconds = perf_counter() - began
+        return {'rows': rows, 'seconds': seconds, 'rows_per_sec': rows / seconds if seconds else 0.0}
+
+    @staticmethod
+    def _bulk_insert(lst, session, batch_size, chunk_commit):
+        """Inserts lst in batches grouped by class, parent tables first, and returns the row count"""
+        groups = {}
+        for obj in lst:
+            groups.setdefault(type(obj), []).append(obj)
+
+        saved = {id(obj) for obj in lst}
+        for obj in lst:
+            for rel in inspect(obj).mapper.relationships:
+                parent = obj.__dict__.get(rel.key)
+                if rel.direction is MANYTOONE and parent is not None and id(parent) not in saved and not _has_keys(parent):
+                    raise ValueError(f'{obj!r} refers to {parent!r}, which is not saved')
+
+        tables = Base.metadata.sorted_tables
+        classes = sorted(groups, key=lambda cls: tables.index(inspect(cls).local_table))
+        inserted = []
+        rows = 0
+
+        for cls in classes:
+            mapper = inspect(cls)
+            objs = groups[cls]
+
+            for idx in range(0, len(objs), batch_size):
+                batch = objs[idx:idx + batch_size]
+                rows += Base._insert_batch(mapper, batch, session, inserted)
+
+                if chunk_commit:
+                    session.commit()
+
+        Base._update_late_keys(inserted, session)
+        for _, obj, _ in inserted:
+            make_transient_to_detached(obj)
+
+        return rows
+
+    @staticmethod
+    def _insert_batch(mapper, batch, session, inserted):
+        """
+        Inserts one batch of instances of a single mapped class, and their pending
+        write-only children, and returns the row count. (mapper, instance, inserted
+        values) is appended to inserted for each row.
+        """
+        keys = [prop.key for prop in mapper.column_attrs]
+        pk_keys = [mapper.get_property_by_column(col).key for col in mapper.primary_key]
+        params = []
+
+        for obj in batch:
+            _copy_parent_keys(mapper, obj)
+            params.append({key: obj.__dict__[key] for key in keys if obj.__dict__.get(key) is not None})
+
+        # Fetch generated primary keys so they can be written back to the instances
+        missing = [key for key in pk_keys if any(key not in row for row in params)]
+        if missing:
+            columns = [getattr(mapper.class_, key) for key in missing]
+            stmt = insert(mapper.class_).returning(*columns, sort_by_parameter_order=True)
+            for obj, generated in zip(batch, session.execute(stmt, params)):
+                for key, value in zip(missing, generated):
+                    setattr(obj, key, value)
+        else:
+            session.execute(insert(mapper.class_), params)
+
+        rows = len(batch)
+        for rel in mapper.relationships:
+            if rel.lazy in WRITE_ONLY:
+                children = _pending_children(mapper, rel, batch)
+                if children:
+                    rows += Base._insert_batch(inspect(children[0]).mapper, children, session, inserted)
+
+        for obj, row in zip(batch, params):
+            _copy_child_keys(mapper, obj)
+            inserted.append((mapper, obj, row))
+
+        return rows
+
+    @staticmethod
+    def _update_late_keys(inserted, session):
+        """Writes the foreign keys that were only known after their row was inserted, with one UPDATE per class"""
+        updates = {}
+
+        for mapper, obj, row in inserted:
+            _copy_parent_keys(mapper, obj)
+            late = {key: obj.__dict__[key] for key in _foreign_keys(mapper)
+                    if key not in row and obj.__dict__.get(key) is not None}
+            if late:
+                for col in mapper.primary_key:
+                    key = mapper.get_property_by_column(col).key
+                    late[key] = obj.__dict__[key]
+                updates.setdefault(mapper.class_, []).append(late)
+
+        for cls, rows in updates.items():
+            session.execute(update(cls), rows)
 
     @classmethod
     def get_all(cls, session):
@@ -25,4 +150,127 @@ class Base(DeclarativeBase):
         stmt = select(cls)
         return session.scalars(stmt).all()
 
-    
+    @classmethod
+    def stream(cls, session, where=None, order_by=None, chunk_size=1000):
+        """
+        Yields instances of class from the database chunk_size rows at a time,
+        so large tables can be iterated without loading every instance at once.
+        where is a condition or list of conditions, order_by an attribute name or column.
+        """
+        stmt = cls._filtered(select(cls), where, order_by)
+        result = session.scalars(stmt, execution_options={'yield_per': chunk_size})
+
+        for chunk in result.partitions():
+            yield from chunk
+
+    @classmethod
+    def get_page(cls, session, where=None, order_by=None, after=None, limit=100):
+        """
+        Returns a page of up to limit instances using keyset pagination, ordered by
+        order_by and then primary key. Returns (instances, key) where key is passed
+        as after to fetch the next page, or is None once the last page is reached.
+        """
+        columns = cls._key_columns(order_by)
+        stmt = cls._filtered(select(cls), where).order_by(*columns).limit(limit)
+
+        if after is not None:
+            stmt = stmt.where(tuple_(*columns) > tuple_(*after))
+
+        objs = session.scalars(stmt).all()
+        if len(objs) < limit:
+            return objs, None
+
+        last = objs[-1]
+        return objs, tuple(getattr(last, col.key) for col in columns)
+
+    @classmethod
+    def project(cls, session, *names, where=None, order_by=None, chunk_size=1000):
+        """
+        Yields lightweight named tuples of the given column attributes instead of
+        ORM instances, e.g. Room.project(session, '_room_number', '_rate').
+        Leading underscores are dropped from the field names.
+        """
+        columns = [getattr(cls, name) for name in names]
+        Row = namedtuple(f'{cls.__name__}Row', [name.lstrip('_') for name in names])
+
+        stmt = cls._filtered(select(*columns), where, order_by)
+        result = session.execute(stmt, execution_options={'yield_per': chunk_size})
+
+        for chunk in result.partitions():
+            for row in chunk:
+                yield Row._make(row)
+
+    @classmethod
+    def _filtered(cls, stmt, where=None, order_by=None):
+        """Applies optional where conditions and ordering to a select statement"""
+        if where is not None:
+            stmt = stmt.where(*where) if isinstance(where, (list, tuple)) else stmt.where(where)
+
+        if order_by is not None:
+            stmt = stmt.order_by(getattr(cls, order_by) if isinstance(order_by, str) else order_by)
+
+        return stmt
+
+    @classmethod
+    def _key_columns(cls, order_by=None):
+        """Returns the columns used as a keyset: order_by (if any) followed by the primary key"""
+        mapper = inspect(cls)
+        columns = [getattr(cls, mapper.get_property_by_column(col).key) for col in mapper.primary_key]
+
+        if order_by is not None:
+            column = getattr(cls, order_by) if isinstance(order_by, str) else order_by
+            if column.key not in [col.key for col in columns]:
+                columns.insert(0, column)
+
+        return columns
+
+def _copy_keys(source_mapper, source, target_mapper, target, pairs):
+    """Copies column values from source to target for (source column, target column) pairs"""
+    for source_col, target_col in pairs:
+        value = source.__dict__.get(source_mapper.get_property_by_column(source_col).key)
+        if value is not None:
+            setattr(target, target_mapper.get_property_by_column(target_col).key, value)
+
+def _copy_parent_keys(mapper, obj):
+    """Fills in foreign keys of obj from the related instances of its many-to-one relationships"""
+    for rel in mapper.relationships:
+        parent = obj.__dict__.get(rel.key)
+        if rel.direction is MANYTOONE and parent is not None:
+            pairs = [(remote, local) for local, remote in rel.local_remote_pairs]
+            _copy_keys(inspect(parent).mapper, parent, mapper, obj, pairs)
+
+def _copy_child_keys(mapper, obj):
+    """Fills in foreign keys of the related instances of obj's one-to-many relationships"""
+    for rel in mapper.relationships:
+        children = obj.__dict__.get(rel.key)
+        if rel.direction is not ONETOMANY or rel.lazy in WRITE_ONLY or children is None:
+            continue
+
+        if not rel.uselist:
+            children = [children]
+
+        for child in children:
+            _copy_keys(mapper, obj, inspect(child).mapper, child, rel.local_remote_pairs)
+
+def _pending_children(mapper, rel, batch):
+    """Returns the instances added to a write-only relationship of the objs in batch, with their foreign keys filled in"""
+    children = []
+    for obj in batch:
+        for child in inspect(obj).attrs[rel.key].history.added:
+            _copy_keys(mapper, obj, inspect(child).mapper, child, rel.local_remote_pairs)
+            children.append(child)
+
+    return children
+
+def _foreign_keys(mapper):
+    """Returns the attribute names of the foreign key columns of mapper"""
+    return [prop.key for prop in mapper.column_attrs if any(col.foreign_keys for col in prop.columns)]
+
+def _has_keys(obj):
+    """Returns True if obj is persistent or detached, or every primary key attribute of it is set"""
+    state = inspect(obj)
+    if state.identity is not None:
+        return True
+
+    mapper = state.mapper
+    return all(obj.__dict__.get(mapper.get_property_by_column(col).key) is not None for col in mapper.primary_key)
@@ -0,0 +1,339 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Microbenchmarks for the core domain operations on synthetic hotels
+
+import argparse
+import gc
+import json
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from base import Base
+from account import Account
+from availability import NightCalendar
+from person import Guest, Employee
+from room import Room, RoomFactory
+from schedule import Schedule, Shift
+from stay import Stay
+from utils import get_session
+
+ROOM_TYPES = ['queen', 'king', '2 queens', 'suite']
+EPOCH = datetime(2023, 1, 1)
+
+# Timed passes per measurement, and untimed passes run before them
+REPEAT = 5
+WARMUP = 1
+
+def make_rooms(num_rooms, stays_per_room=10, seed=0):
+    """Returns num_rooms rooms and their stays, each room booked for stays_per_room stays of 1-7 nights"""
+    rng = random.Random(seed)
+    rooms = []
+    stays = []
+
+    for num in range(1, num_rooms + 1):
+        room = Room(num, rng.choice(ROOM_TYPES), rng.choice([100, 125, 150, 200]))
+        start = EPOCH + timedelta(days=rng.randint(0, 6))
+
+        for _ in range(stays_per_room):
+            end = start + timedelta(days=rng.randint(1, 7))
+            stays.append(Stay(room, start, end))
+            start = end + timedelta(days=rng.randint(1, 3))
+
+        rooms.append(room)
+
+    return rooms, stays
+
+def make_staff(num_employees, weeks=52, shifts_per_week=5, seed=0):
+    """Returns employees that each have a year of weekly schedules with worked shifts"""
+    rng = random.Random(seed)
+    employees = []
+
+    for idx in range(num_employees):
+        emp = Employee(rng.choice([15, 20, 25]), f'Employee {idx}', f'employee{idx}@email.com')
+
+        for week in range(weeks):
+            week_start = EPOCH.date() + timedelta(weeks=week)
+            schedule = Schedule(week_start)
+
+            for day in range(shifts_per_week):
+                start = datetime.combine(week_start + timedelta(days=day), datetime.min.time()) + timedelta(hours=8)
+                shift = Shift(start, start + timedelta(hours=8))
+                shift.set_real_start(start)
+                shift.set_real_end(start + timedelta(hours=rng.uniform(7, 10)))
+                schedule.add_shift(shift)
+
+            emp.add_schedule(schedule)
+        employees.append(emp)
+
+    return employees
+
+def measure(run, repeat=REPEAT, warmup=WARMUP):
+    """
+    Calls run() warmup times, then repeat times, and returns the smallest value it
+    returned with the noise of the timed passes: how far the slowest is above it,
+    relative to it.
+    """
+    for _ in range(warmup):
+        run()
+
+    # Like timeit, keep garbage collection pauses out of the timed passes
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        values = sorted(run() for _ in range(max(repeat, 1)))
+    finally:
+        if enabled:
+            gc.enable()
+
+    best = values[0]
+    return best, (values[-1] / best - 1 if best else 0.0)
+
+def time_per_call(func, args, repeat=REPEAT, warmup=WARMUP):
+    """
+    Returns (seconds, noise) for the fastest mean seconds per call of func over the
+    argument tuples in args, across repeat passes. args can also be a function
+    returning new argument tuples for each pass, for calls that can't be repeated.
+    """
+    def run():
+        calls = args() if callable(args) else args
+        began = perf_counter()
+        for arg in calls:
+            func(*arg)
+        return (perf_counter() - began) / max(len(calls), 1)
+
+    return measure(run, repeat, warmup)
+
+def rows_per_sec(save, repeat=REPEAT, warmup=WARMUP):
+    """Returns (rows per second, noise) for the fastest of the Base.save_all results returned by save()"""
+    def run():
+        saved = save()
+        return saved['seconds'] / max(saved['rows'], 1)
+
+    seconds, noise = measure(run, repeat, warmup)
+    return (1 / seconds if seconds else 0.0), noise
+
+def bench_rooms(size, stays_per_room, calls, rng, repeat=REPEAT):
+    """Times the room, stay and guest operations for a hotel with size rooms and returns {op: (value, noise)}"""
+    results = {}
+    seed = rng.random()
+    rooms, stays = make_rooms(size, stays_per_room, seed)
+    horizon = stays_per_room * 5
+
+    dates = [EPOCH + timedelta(days=rng.randint(0, horizon), hours=rng.randint(0, 23)) for _ in range(calls)]
+    picks = [(rng.choice(rooms), day, day + timedelta(days=2)) for day in dates]
+    results['Room.available_on'] = time_per_call(lambda room, start, end: room.available_on(start, end), picks, repeat)
+
+    factory = RoomFactory()
+    for room in rooms[:len(ROOM_TYPES) * 4]:
+        factory.register(room.get_type(), room)
+    keys = [(rng.choice(list(factory._registry)),) for _ in range(calls)]
+    results['RoomFactory.get'] = time_per_call(factory.get, keys, repeat)
+
+    moves = [(stay, stay.get_end()) for stay in rng.sample(stays, min(calls, len(stays)))]
+    results['Stay.set_end'] = time_per_call(lambda stay, end: stay.set_end(end), moves, repeat)
+
+    # Every pass books a new guest into later dates, so no booking overlaps an earlier pass
+    booked_rooms = rng.choices(rooms, k=calls)
+    passes = []
+
+    def bookings():
+        guest = Guest(Account(), 'Benchmark Guest', 'benchmark@email.com')
+        future = EPOCH + timedelta(days=horizon * 2 + 3 * calls * len(passes))
+        passes.append(guest)
+        return [(guest, room, future + timedelta(days=3 * idx)) for idx, room in enumerate(booked_rooms)]
+
+    results['Guest.book_stay'] = time_per_call(
+        lambda guest, room, start: guest.book_stay(Stay(room, start, start + timedelta(days=2))), bookings, repeat)
+
+    sessions = []
+
+    def save_bulk():
+        for session in sessions:
+            session.close()
+        sessions[:] = [get_session()]
+        fresh_rooms, fresh_stays = make_rooms(size, stays_per_room, seed)
+        objs = fresh_rooms + fresh_stays + [stay._unavailability for stay in fresh_stays]
+        return Base.save_all(objs, sessions[0], bulk=True)
+
+    results['Base.save_all (bulk) rows/sec'] = rows_per_sec(save_bulk, repeat)
+
+    session = sessions[0]
+    queries = [(day, day + timedelta(days=2)) for day in dates[:max(calls // 50, 10)]]
+    results['Room.get_all_available'] = time_per_call(
+        lambda start, end: Room.get_all_available(session, start, end), queries, repeat)
+    session.close()
+
+    seed = rng.random()
+
+    def save():
+        session = get_session()
+        try:
+            return Base.save_all(make_rooms(size, 0, seed)[0], session)
+        finally:
+            session.close()
+
+    results['Base.save_all rows/sec'] = rows_per_sec(save, repeat)
+
+    return results
+
+def bench_staff(num_employees, calls, rng, repeat=REPEAT):
+    """Times schedule operations for num_employees employees with a year of shifts each"""
+    employees = make_staff(num_employees, seed=rng.random())
+    schedules = [(sched,) for emp in employees for sched in emp.get_all_schedules()]
+    picks = rng.choices(schedules, k=calls)
+
+    return {
+        'Schedule.hours_worked': time_per_call(Schedule.hours_worked, picks, repeat),
+        'Employee.get_current_schedule': time_per_call(Employee.get_current_schedule, [(emp,) for emp in employees], repeat),
+    }
+
+def make_ranges(days, rng):
+    """Returns unavailable ranges of 1-7 nights separated by 1-3 night gaps, covering days from EPOCH"""
+    horizon = EPOCH + timedelta(days=days)
+    start = EPOCH + timedelta(days=rng.randint(0, 6))
+    ranges = []
+
+    while True:
+        end = start + timedelta(days=rng.randint(1, 7))
+        if end > horizon:
+            return ranges
+
+        ranges.append((start, end))
+        start = end + timedelta(days=rng.randint(1, 3))
+
+def traced_bytes(build):
+    """Returns the result of build() and the bytes it left allocated"""
+    tracemalloc.start()
+    try:
+        result = build()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+def bench_memory(num_rooms=10000, days=730, sample=1000, seed=0):
+    """
+    Compares the memory per room of Room instances holding their unavailable ranges
+    as Unavailability rows with that of a NightCalendar for the same ranges, over
+    days of horizon. Both are measured on sample rooms and projected to num_rooms.
+    """
+    rng = random.Random(seed)
+    sample = min(sample, num_rooms)
+    ranges = [make_ranges(days, rng) for _ in range(sample)]
+
+    def build_rooms():
+        rooms = []
+        for num, room_ranges in enumerate(ranges):
+            room = Room(num, 'queen', 100)
+            for start, end in room_ranges:
+                room.add_unavailable(start, end)
+            rooms.append(room)
+        return rooms
+
+    _, room_bytes = traced_bytes(build_rooms)
+    _, calendar_bytes = traced_bytes(lambda: [NightCalendar(EPOCH, room_ranges) for room_ranges in ranges])
+
+    return {
+        'rooms': num_rooms,
+        'days': days,
+        'ranges_per_room': sum(map(len, ranges)) / sample,
+        'room_bytes_per_room': room_bytes / sample,
+        'calendar_bytes_per_room': calendar_bytes / sample,
+        'room_total_mb': room_bytes / sample * num_rooms / 2 ** 20,
+        'calendar_total_mb': calendar_bytes / sample * num_rooms / 2 ** 20,
+    }
+
+def run(sizes, stays_per_room=10, max_employees=1000, calls=1000, seed=0, repeat=REPEAT):
+    """
+    Runs every benchmark for each hotel size and returns JSON-serializable results:
+    the best of repeat passes per operation and size, and the noise of each.
+    """
+    rng = random.Random(seed)
+    results = {}
+    noise = {}
+
+    for size in sizes:
+        timings = bench_rooms(size, stays_per_room, calls, rng, repeat)
+        timings.update(bench_staff(min(max(size // 10, 1), max_employees), calls, rng, repeat))
+
+        for op, (value, spread) in timings.items():
+            results.setdefault(op, {})[str(size)] = value
+            noise.setdefault(op, {})[str(size)] = spread
+
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'stays_per_room': stays_per_room,
+        'repeat': repeat,
+        'results': results,
+        'noise': noise,
+    }
+
+def compare(baseline, current, tolerance=0.25):
+    """
+    Returns (operation, size, baseline, current) for every measurement that got
+    worse by more than tolerance plus the noise measured for it in both runs.
+    Timings regress when they grow, rates (operations ending in '/sec') when they shrink.
+    """
+    regressions = []
+
+    for op, by_size in current['results'].items():
+        for size, value in by_size.items():
+            old = baseline['results'].get(op, {}).get(size)
+            if old is None: continue
+
+            headroom = (tolerance + baseline.get('noise', {}).get(op, {}).get(size, 0.0)
+                        + current.get('noise', {}).get(op, {}).get(size, 0.0))
+            if op.endswith('/sec'):
+                worse = value < old / (1 + headroom)
+            else:
+                worse = value > old * (1 + headroom)
+
+            if worse:
+                regressions.append((op, size, old, value))
+
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark core hotel management operations')
+    parser.add_argument('--sizes', default='100,1000,10000', help='comma separated room counts, e.g. 100,1000,100000')
+    parser.add_argument('--stays-per-room', type=int, default=10)
+    parser.add_argument('--max-employees', type=int, default=1000)
+    parser.add_argument('--calls', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='timed passes per measurement; the best is kept')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results from an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--memory', action='store_true',
+                        help='only compare the memory of room calendars at 10000 rooms x 2 years')
+    args = parser.parse_args(argv)
+
+    if args.memory:
+        for name, value in bench_memory().items():
+            print(f'{name:34} {value:.6g}')
+        return 0
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes, args.stays_per_room, args.max_employees, args.calls, repeat=args.repeat)
+
+    for op, by_size in results['results'].items():
+        row = ', '.join(f'{size}: {value:.3g}' for size, value in by_size.items())
+        print(f'{op:34} {row}')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), results, args.tolerance)
+
+        for op, size, old, new in regressions:
+            print(f'REGRESSION {op} at {size}: {old:.3g} -> {new:.3g}')
+
+        return 1 if regressions else 0
+
+    return 0
+
+if __name__ == '__main__': sys.exit(main())
@@ -0,0 +1,113 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Concurrency-safe booking using optimistic locking on rooms
+
+import random
+from time import sleep
+from sqlalchemy import select, delete, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.exc import StaleDataError
+from person import Guest
+from room import Room, Unavailability
+from stay import Stay, RoomUnavailableError
+
+class BookingConflictError(Exception):
+    """Raised when a booking keeps losing races with other workers after every retry"""
+
+def book_stay(factory, room_number, start, end, guest_id=None, retries=10):
+    """
+    Books room_number for [start, end) in its own transaction using a session
+    from the scoped session factory, and returns the new stay id, or None if the
+    room is not available. The room's version column makes a concurrent booking
+    of the same room fail on flush, in which case the booking is retried against
+    fresh data after a short random backoff.
+    """
+    for attempt in range(retries):
+        session = factory()
+        try:
+            stay = Stay(session.get(Room, room_number), start, end)
+
+            if guest_id is None:
+                session.add(stay)
+            else:
+                session.get(Guest, guest_id).book_stay(stay)
+
+            session.commit()
+            return stay._id
+        except RoomUnavailableError:
+            session.rollback()
+            return None
+        except (StaleDataError, OperationalError):
+            session.rollback()
+            sleep(random.uniform(0, 0.002 * (attempt + 1)))
+        finally:
+            factory.remove()
+
+    raise BookingConflictError(f'Could not book room {room_number} after {retries} attempts')
+
+def count_double_bookings(session):
+    """Returns the number of pairs of overlapping unavailable ranges for the same room"""
+    first = aliased(Unavailability)
+    second = aliased(Unavailability)
+    stmt = select(func.count()).select_from(first).join(second, (first._room_number == second._room_number) & (first._id < second._id)).where(
+        first._start < second._end,
+        second._start < first._end,
+    )
+    return session.scalar(stmt)
+
+def stress_test(path, workers=(1, 2, 4, 8), rooms=20, attempts=400):
+    """
+    Books the same small set of rooms and dates from a growing number of threads
+    and returns a list of (workers, bookings, double bookings, bookings per second).
+    """
+    from datetime import datetime, timedelta
+    from threading import Thread
+    from time import perf_counter
+    from base import Base
+    from utils import get_session, get_session_factory
+
+    factory = get_session_factory(path)
+    results = []
+
+    for count in workers:
+        session = get_session(path=path)
+        for cls in [Unavailability, Stay, Room]:
+            session.execute(delete(cls))
+        Base.save_all([Room(num, 'queen', 100) for num in range(1, rooms + 1)], session)
+        session.close()
+
+        requests = [(random.randint(1, rooms), datetime(2023, 8, 1) + timedelta(days=random.randint(0, 30)))
+                    for _ in range(attempts)]
+        booked = []
+
+        def work(chunk):
+            for room_number, start in chunk:
+                stay_id = book_stay(factory, room_number, start, start + timedelta(days=3))
+                if stay_id is not None:
+                    booked.append(stay_id)
+
+        threads = [Thread(target=work, args=(requests[idx::count],)) for idx in range(count)]
+        began = perf_counter()
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        elapsed = perf_counter() - began
+
+        session = get_session(path=path)
+        results.append((count, len(booked), count_double_bookings(session), len(booked) / elapsed))
+        session.close()
+
+    return results
+
+def test():
+    import os
+    import tempfile
+    from utils import dispose_engines
+
+    path = os.path.join(tempfile.mkdtemp(), 'booking.db')
+    for workers, bookings, doubles, rate in stress_test(path):
+        print(f'{workers} workers: {bookings} bookings, {doubles} double bookings, {rate:.0f} bookings/sec')
+        # -> 0 double bookings for every worker count
+
+    dispose_engines()
+
+if __name__ == '__main__': test()
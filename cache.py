@@ -0,0 +1,365 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Process-level read-through cache of rooms and their availability
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from availability import IntervalIndex
+from room import Room, Unavailability
+
+class CachedRoom:
+    """Read-only copy of a room's columns and unavailable ranges, safe to share between sessions and threads"""
+
+    __slots__ = ('_room_number', '_type', '_rate', '_version', '_index')
+
+    def __init__(self, room_number, type, rate, version, unavailable=()):
+        self._room_number = room_number
+        self._type = type
+        self._rate = rate
+        self._version = version
+        self._index = IntervalIndex(unavailable)
+
+    def get_room_number(self):
+        return self._room_number
+
+    def get_type(self):
+        return self._type
+
+    def get_rate(self):
+        return self._rate
+
+    def get_version(self):
+        return self._version
+
+    def available_on(self, start_date, end_date=None):
+        """Same check as Room.available_on"""
+        if self._index.covers(start_date):
+            return False
+
+        if end_date and self._index.covers(end_date):
+            return False
+
+        return True
+
+    def calculate_total(self, num_days):
+        return self._rate * num_days
+
+    def __repr__(self):
+        return f'<CachedRoom {self._room_number}: ${self._rate:.2f}>'
+
+class RoomCache:
+    """
+    Least recently used cache of up to max_size rooms that expire after ttl
+    seconds, indexed by database (the session's bind), room number and room type.
+    Misses are read through from the database with the session passed in, and
+    only cached if that session has no uncommitted changes to rooms.
+
+    Entries are invalidated when a transaction that changed them ends: flushed
+    Room and Unavailability changes (rates, room numbers, availability) drop the
+    rooms involved, and bulk INSERT/UPDATE/DELETE statements on either table, such
+    as Room.set_type_rate, drop every room of that database. Call close() to stop
+    listening.
+
+    Stay.get_room and Room.get_all_available don't go through the cache, since
+    their callers change the ORM instances they return; use get and
+    get_all_available here for read-only lookups and searches.
+    """
+
+    def __init__(self, max_size=10000, ttl=300.0):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = Lock()
+        self._entries = OrderedDict()    # (bind, room number) -> (CachedRoom, expiry)
+        self._types = {}                 # (bind, room type) -> room numbers
+        self._complete_types = {}        # (bind, room type) -> expiry of the complete listing
+        self._complete_until = {}        # bind -> expiry of the complete listing
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'do_orm_execute', self._on_execute)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_transaction_end', self._after_transaction_end)
+
+    def close(self):
+        """Stops listening to session events and empties the cache"""
+        event.remove(Session, 'after_flush', self._after_flush)
+        event.remove(Session, 'do_orm_execute', self._on_execute)
+        event.remove(Session, 'after_commit', self._after_commit)
+        event.remove(Session, 'after_transaction_end', self._after_transaction_end)
+        self.clear()
+
+    def get(self, session, room_number):
+        """Returns the CachedRoom for room_number, or None if there is no such room"""
+        bind = session.get_bind()
+        with self._lock:
+            entry = self._lookup((bind, room_number))
+            generation = self._generation
+
+        if entry is not None:
+            return entry
+
+        rooms = self._load(session, Room._room_number == room_number)
+        self._store(session, rooms, generation)
+        return rooms[0] if rooms else None
+
+    def get_by_type(self, session, type):
+        """Returns the CachedRooms of a room type ordered by room number"""
+        with self._lock:
+            rooms = self._listing(session.get_bind(), type)
+            generation = self._generation
+
+        if rooms is not None:
+            return rooms
+
+        rooms = self._load(session, Room._type == type)
+        self._store(session, rooms, generation, type=type)
+        return rooms
+
+    def get_all(self, session):
+        """Returns the CachedRooms of every room ordered by room number"""
+        with self._lock:
+            rooms = self._listing(session.get_bind())
+            generation = self._generation
+
+        if rooms is not None:
+            return rooms
+
+        rooms = self._load(session)
+        self._store(session, rooms, generation, complete=True)
+        return rooms
+
+    def get_all_available(self, session, start_date, end_date=None, type=None):
+        """Returns the CachedRooms (of type, if given) available on the given dates"""
+        rooms = self.get_by_type(session, type) if type else self.get_all(session)
+        return [room for room in rooms if room.available_on(start_date, end_date)]
+
+    def invalidate(self, room_numbers=None, bind=None):
+        """
+        Drops the given rooms from the cache, or every room if room_numbers is None,
+        for the database bind or for every database if bind is None
+        """
+        with self._lock:
+            self._generation += 1
+            self._invalidations += 1
+
+            if room_numbers is None and bind is None:
+                self._clear()
+                return
+
+            for key in list(self._entries):
+                if (bind is None or key[0] is bind) and (room_numbers is None or key[1] in room_numbers):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._clear()
+
+    def get_stats(self):
+        """Returns a dict with the cache size, hits, misses, hit rate, evictions and invalidations"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_size': self._max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+            }
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < monotonic():
+            if entry is not None:
+                self._drop(key)
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return entry[0]
+
+    def _listing(self, bind, type=None):
+        """Returns the cached rooms of type (or all rooms) of bind if the whole set is cached, else None"""
+        until = self._complete_types.get((bind, type)) if type else self._complete_until.get(bind)
+        if until is None or until < monotonic():
+            self._misses += 1
+            return None
+
+        if type:
+            numbers = sorted(self._types.get((bind, type), ()))
+        else:
+            numbers = sorted(num for key_bind, num in self._entries if key_bind is bind)
+
+        for num in numbers:
+            self._entries.move_to_end((bind, num))
+
+        self._hits += 1
+        return [self._entries[(bind, num)][0] for num in numbers]
+
+    def _load(self, session, where=None):
+        """Returns CachedRooms matching where using one query for the rooms and one for their ranges"""
+        stmt = select(Room._room_number, Room._type, Room._rate, Room._version).order_by(Room._room_number)
+        if where is not None:
+            stmt = stmt.where(where)
+        rows = session.execute(stmt).all()
+
+        ranges = {}
+        blocks = select(Unavailability._room_number, Unavailability._start, Unavailability._end)
+        if where is not None:
+            blocks = blocks.where(Unavailability._room_number.in_([row[0] for row in rows]))
+        for room_number, start, end in session.execute(blocks):
+            ranges.setdefault(room_number, []).append((start, end))
+
+        return [CachedRoom(*row, ranges.get(row[0], ())) for row in rows]
+
+    def _store(self, session, rooms, generation, type=None, complete=False):
+        """
+        Caches rooms loaded through session at generation, unless an invalidation
+        happened since or the session holds uncommitted changes to rooms
+        """
+        if _has_room_changes(session):
+            return
+
+        bind = session.get_bind()
+        with self._lock:
+            if generation != self._generation:
+                return
+
+            expires = monotonic() + self._ttl
+            for room in rooms:
+                key = (bind, room.get_room_number())
+                self._drop(key)
+                self._entries[key] = (room, expires)
+                self._types.setdefault((bind, room.get_type()), set()).add(key[1])
+
+            while len(self._entries) > self._max_size:
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+
+            # A listing is only complete if none of its rooms were evicted to make room
+            if len(rooms) <= self._max_size:
+                if type:
+                    self._complete_types[(bind, type)] = expires
+                if complete:
+                    self._complete_until[bind] = expires
+                    for key_bind, name in self._types:
+                        if key_bind is bind:
+                            self._complete_types[(bind, name)] = expires
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None: return
+
+        bind, room_number = key
+        type_key = (bind, entry[0].get_type())
+        self._types[type_key].discard(room_number)
+        self._complete_types.pop(type_key, None)
+        self._complete_until.pop(bind, None)
+
+    def _clear(self):
+        self._entries.clear()
+        self._types.clear()
+        self._complete_types.clear()
+        self._complete_until.clear()
+
+    def _after_flush(self, session, flush_context):
+        """Collects the numbers of the rooms changed by the flush, including their old numbers"""
+        numbers = session.info.setdefault('room_cache_changed', set())
+
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, (Room, Unavailability)):
+                numbers.add(obj._room_number)
+                numbers.update(inspect(obj).attrs._room_number.history.deleted)
+
+    def _on_execute(self, orm_execute_state):
+        """Marks the whole cache as changed for bulk statements on rooms or their ranges"""
+        if orm_execute_state.is_select:
+            return
+
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in (Room, Unavailability):
+            orm_execute_state.session.info['room_cache_all'] = True
+
+    def _after_commit(self, session):
+        changed_all = session.info.pop('room_cache_all', False)
+        numbers = session.info.pop('room_cache_changed', None)
+
+        if changed_all:
+            self.invalidate(bind=session.get_bind())
+        elif numbers:
+            self.invalidate(numbers - {None}, session.get_bind())
+
+    def _after_transaction_end(self, session, transaction):
+        """Forgets the changes of a transaction that was rolled back or closed without committing"""
+        if transaction.parent is None:
+            session.info.pop('room_cache_all', None)
+            session.info.pop('room_cache_changed', None)
+
+def _has_room_changes(session):
+    """Returns True if session has flushed or pending changes to rooms or their ranges that aren't committed"""
+    if session.info.get('room_cache_all') or session.info.get('room_cache_changed'):
+        return True
+
+    return any(isinstance(obj, (Room, Unavailability)) for obj in (*session.new, *session.dirty, *session.deleted))
+
+def test():
+    from datetime import datetime
+    import person    # stays reference the person table
+    from base import Base
+    from stay import Stay
+    from utils import get_session
+
+    cache = RoomCache(max_size=100, ttl=60)
+    session = get_session()
+    Base.save_all([Room(num, 'queen' if num % 2 else 'king', 100) for num in range(1, 11)], session)
+
+    print(cache.get(session, 1))                        # -> <CachedRoom 1: $100.00>
+    print(len(cache.get_by_type(session, 'king')))     # -> 5
+    cache.get(session, 1)
+    cache.get(session, 2)
+    print(cache.get_stats()['hits'], cache.get_stats()['misses'])  # -> 2 2
+
+    room = session.get(Room, 1)
+    room.set_rate(120)
+    session.commit()
+    print(cache.get(session, 1))                        # -> <CachedRoom 1: $120.00>
+
+    session.add(Stay(session.get(Room, 3), datetime(2023, 8, 1), datetime(2023, 8, 5)))
+    session.commit()
+    print(cache.get(session, 3).available_on(datetime(2023, 8, 2)))  # -> False
+
+    Room.set_type_rate('king', 150, session)
+    session.commit()
+    print(cache.get_stats()['size'])                    # -> 0
+    print(cache.get_by_type(session, 'king')[0])       # -> <CachedRoom 2: $150.00>
+
+    Room.set_type_rate('queen', 50, session)
+    session.rollback()
+    print(cache.get(session, 1))                        # -> <CachedRoom 1: $120.00>
+
+    # Rooms read with uncommitted changes are returned but not cached
+    session.get(Room, 5).set_rate(80)
+    print(cache.get(session, 5))                        # -> <CachedRoom 5: $80.00>
+    session.rollback()
+    print(cache.get(session, 5))                        # -> <CachedRoom 5: $100.00>
+
+    # Each database has its own entries
+    other = get_session()
+    Base.save_all([Room(1, 'suite', 300)], other)
+    print(cache.get(other, 1), cache.get(session, 1))   # -> <CachedRoom 1: $300.00> <CachedRoom 1: $120.00>
+    print(len(cache.get_all(other)), len(cache.get_all(session)))  # -> 1 10
+    other.close()
+
+    cache.close()
+    session.close()
+
+if __name__ == '__main__': test()
@@ -0,0 +1,248 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Write-behind buffer for shift clock-in and clock-out taps
+
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+from threading import Event, Lock, Thread
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from schedule import Shift
+
+ClockEvent = namedtuple('ClockEvent', 'shift_id kind at')
+
+KINDS = ('in', 'out')
+
+class ClockBuffer:
+    """
+    Acknowledges clock taps as soon as they are recorded in memory and appended to
+    a local journal file, and writes them to the shift table later in batched
+    transactions. A flush runs once max_events taps are waiting or max_delay
+    seconds after the last one, whichever comes first.
+
+    Each tap keeps the time it was made, so replaying the journal after a crash
+    stamps the same times. The journal is cut back to the unflushed taps after
+    every successful flush and replayed when a buffer is created on the same path.
+    """
+
+    def __init__(self, factory, journal_path, max_events=200, max_delay=1.0, sync=False):
+        self._factory = factory
+        self._journal_path = journal_path
+        self._max_events = max_events
+        self._max_delay = max_delay
+        self._sync = sync
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wake = Event()
+        self._closed = False
+        self._flushed = 0
+        self._ignored = 0
+        self._batches = 0
+        self._errors = 0
+
+        self._pending = _read_journal(journal_path)
+        self._journal = open(journal_path, 'a')
+
+        # Replay taps left in the journal by a previous run
+        if self._pending:
+            try:
+                self.flush()
+            except Exception:
+                pass    # retried by the flush thread
+
+        self._worker = Thread(target=self._run, name='clock-buffer', daemon=True)
+        self._worker.start()
+
+    def tap(self, shift_id, kind, at=None):
+        """Records a clock 'in' or 'out' tap for the shift and returns the ClockEvent"""
+        if kind not in KINDS:
+            raise ValueError(f'Clock tap kind must be one of {KINDS}')
+
+        event = ClockEvent(shift_id, kind, at or datetime.now())
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Clock buffer is closed')
+
+            self._write(event)
+            self._pending.append(event)
+            full = len(self._pending) >= self._max_events
+
+        if full:
+            self._wake.set()
+
+        return event
+
+    def clock_in(self, shift_id, at=None):
+        return self.tap(shift_id, 'in', at)
+
+    def clock_out(self, shift_id, at=None):
+        return self.tap(shift_id, 'out', at)
+
+    def get_pending(self):
+        """Returns the number of taps not yet written to the database"""
+        return len(self._pending)
+
+    def get_stats(self):
+        """Returns a dict with the pending, flushed and ignored taps, batches and failed flushes"""
+        return {
+            'pending': self.get_pending(),
+            'flushed': self._flushed,
+            'ignored': self._ignored,
+            'batches': self._batches,
+            'errors': self._errors,
+        }
+
+    def flush(self):
+        """
+        Writes every pending tap to the database in one transaction and returns the
+        number applied. Taps for unknown shifts, or that don't change the shift
+        (e.g. clocking in twice), are counted as ignored.
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self._pending = self._pending, []
+
+            if not events:
+                return 0
+
+            try:
+                applied = self._apply(events)
+            except Exception:
+                with self._lock:
+                    self._pending = events + self._pending
+                    self._errors += 1
+                raise
+
+            with self._lock:
+                self._rewrite_journal()
+                self._flushed += applied
+                self._ignored += len(events) - applied
+                self._batches += 1
+
+            return applied
+
+    def close(self):
+        """Flushes the remaining taps and stops the flush thread"""
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        self._worker.join()
+
+        self.flush()
+        self._journal.close()
+
+    def _apply(self, events):
+        session = self._factory()
+        try:
+            ids = {event.shift_id for event in events}
+            stmt = select(Shift).where(Shift._id.in_(ids)).options(joinedload(Shift._schedule))
+            shifts = {shift._id: shift for shift in session.scalars(stmt)}
+            applied = 0
+
+            for event in events:
+                shift = shifts.get(event.shift_id)
+                if shift is None: continue
+
+                if event.kind == 'in':
+                    applied += shift.clock_in(event.at)
+                else:
+                    applied += shift.clock_out(event.at)
+
+            session.commit()
+            return applied
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            self._factory.remove()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self._max_delay)
+            self._wake.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                pass    # the taps stay pending and are retried on the next flush
+
+    def _write(self, event):
+        self._journal.write(json.dumps([event.shift_id, event.kind, event.at.isoformat()]) + '\n')
+        self._journal.flush()
+        if self._sync:
+            os.fsync(self._journal.fileno())
+
+    def _rewrite_journal(self):
+        """Replaces the journal with the taps that are still pending"""
+        self._journal.close()
+        temp_path = self._journal_path + '.tmp'
+
+        with open(temp_path, 'w') as file:
+            for event in self._pending:
+                file.write(json.dumps([event.shift_id, event.kind, event.at.isoformat()]) + '\n')
+
+        os.replace(temp_path, self._journal_path)
+        self._journal = open(self._journal_path, 'a')
+
+def _read_journal(path):
+    """Returns the ClockEvents in the journal at path, skipping a partially written last line"""
+    if not os.path.exists(path):
+        return []
+
+    events = []
+    with open(path) as file:
+        for line in file:
+            try:
+                shift_id, kind, at = json.loads(line)
+            except ValueError:
+                continue
+            events.append(ClockEvent(shift_id, kind, datetime.fromisoformat(at)))
+
+    return events
+
+def test():
+    import tempfile
+    from base import Base
+    from person import Employee
+    from schedule import Schedule
+    from utils import get_session, get_session_factory, dispose_engines
+
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, 'clock.db')
+    journal = os.path.join(folder, 'clock.journal')
+
+    session = get_session(path=path)
+    schedule = Schedule(datetime(2023, 8, 7).date())
+    for day in range(7, 10):
+        schedule.add_shift(Shift(datetime(2023, 8, day, 8), datetime(2023, 8, day, 16)))
+    employee = Employee(20, 'Julian', 'clock@email.com')
+    employee.add_schedule(schedule)
+    Base.save_all([employee], session)
+    shift_ids = [shift._id for shift in schedule.get_shifts()]
+    session.close()
+
+    factory = get_session_factory(path)
+    buffer = ClockBuffer(factory, journal, max_delay=60)
+    for shift_id in shift_ids:
+        buffer.clock_in(shift_id, datetime(2023, 8, 7, 8))
+    print(buffer.get_pending())                 # -> 3
+
+    # Abandon the buffer without flushing, as if the process crashed, and replay the journal
+    buffer = ClockBuffer(factory, journal, max_delay=60)
+    print(buffer.get_stats()['flushed'])        # -> 3
+
+    buffer.clock_out(shift_ids[0], datetime(2023, 8, 7, 15, 30))
+    buffer.clock_out(shift_ids[0])               # ignored, already clocked out
+    print(buffer.get_pending())                 # -> 2
+    print(buffer.flush())                       # -> 1
+    buffer.close()
+    print(os.path.getsize(journal))             # -> 0
+
+    session = get_session(path=path)
+    schedule = session.get(Schedule, schedule._id)
+    print(schedule._clocked_in_count, schedule._hours_worked)  # -> 2 7.5
+    session.close()
+    dispose_engines()
+
+if __name__ == '__main__': test()
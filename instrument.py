@@ -0,0 +1,240 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Opt-in instrumentation of domain operations and SQL statements
+
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from inspect import isgeneratorfunction
+from threading import Lock
+from time import perf_counter
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from base import Base
+from room import Room
+from stay import Stay
+from person import Guest, Employee
+from schedule import Schedule, Shift
+
+# Methods wrapped by enable(), by class
+OPERATIONS = {
+    Base: ['save', 'save_all', 'get_all', 'stream', 'get_page', 'project'],
+    Room: ['available_on', 'add_unavailable', 'remove_unavailable', 'calculate_total',
+           'get_all_available', 'set_type_rate'],
+    Stay: ['set_room', 'set_start', 'set_end', 'check_in', 'check_out', 'get_total_charge'],
+    Guest: ['get_stay', 'find_stay', 'book_stay', 'cancel_stay', 'alter_stay'],
+    Employee: ['apply_schedule_hours', 'is_clocked_in', 'get_current_schedule', 'find_current_schedule'],
+    Schedule: ['add_shift', 'remove_shift', 'get_current_shift', 'find_current_shift',
+               'hours_scheduled', 'hours_worked'],
+    Shift: ['clock_in', 'clock_out'],
+}
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+
+UNATTRIBUTED = 'unattributed'
+
+_current = ContextVar('operation', default=UNATTRIBUTED)
+
+class Metrics:
+    """Thread-safe call counts, latency histograms and SQL statement totals per operation"""
+
+    def __init__(self, buckets=BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = Lock()
+        self._ops = {}
+
+    def record_call(self, name, seconds):
+        with self._lock:
+            op = self._get(name)
+            op['calls'] += 1
+            op['seconds'] += seconds
+            op['buckets'][bisect_left(self._buckets, seconds)] += 1
+
+    def record_sql(self, name, seconds):
+        with self._lock:
+            op = self._get(name)
+            op['sql_statements'] += 1
+            op['sql_seconds'] += seconds
+
+    def reset(self):
+        with self._lock:
+            self._ops = {}
+
+    def snapshot(self):
+        """Returns a copy of the metrics as {operation: {calls, seconds, buckets, sql_statements, sql_seconds}}"""
+        with self._lock:
+            snapshot = {}
+            for name, op in self._ops.items():
+                snapshot[name] = dict(op)
+                snapshot[name]['buckets'] = self._cumulative(op['buckets'])
+
+            return snapshot
+
+    def prometheus(self, prefix='hotel'):
+        """Returns the metrics in the Prometheus text exposition format"""
+        lines = [
+            f'# HELP {prefix}_operation_seconds Latency of domain operations',
+            f'# TYPE {prefix}_operation_seconds histogram',
+        ]
+        snapshot = self.snapshot()
+
+        for name, op in sorted(snapshot.items()):
+            if not op['calls']: continue
+
+            for bound, count in op['buckets'].items():
+                lines.append(f'{prefix}_operation_seconds_bucket{{operation="{name}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_operation_seconds_sum{{operation="{name}"}} {op["seconds"]}')
+            lines.append(f'{prefix}_operation_seconds_count{{operation="{name}"}} {op["calls"]}')
+
+        lines.append(f'# HELP {prefix}_sql_statements_total SQL statements executed during each operation')
+        lines.append(f'# TYPE {prefix}_sql_statements_total counter')
+        for name, op in sorted(snapshot.items()):
+            lines.append(f'{prefix}_sql_statements_total{{operation="{name}"}} {op["sql_statements"]}')
+
+        lines.append(f'# HELP {prefix}_sql_seconds_total Time spent in SQL during each operation')
+        lines.append(f'# TYPE {prefix}_sql_seconds_total counter')
+        for name, op in sorted(snapshot.items()):
+            lines.append(f'{prefix}_sql_seconds_total{{operation="{name}"}} {op["sql_seconds"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _get(self, name):
+        op = self._ops.get(name)
+        if op is None:
+            op = {'calls': 0, 'seconds': 0.0, 'buckets': [0] * (len(self._buckets) + 1),
+                  'sql_statements': 0, 'sql_seconds': 0.0}
+            self._ops[name] = op
+
+        return op
+
+    def _cumulative(self, counts):
+        """Converts per-bucket counts to cumulative counts keyed by upper bound"""
+        cumulative = {}
+        total = 0
+        for bound, count in zip(self._buckets + ('+Inf',), counts):
+            total += count
+            cumulative[str(bound)] = total
+
+        return cumulative
+
+metrics = Metrics()
+_originals = []
+
+def enable(target=None):
+    """Starts recording the operations in OPERATIONS and all SQL statements into target (defaults to metrics)"""
+    global metrics
+    if _originals: return
+
+    if target is not None:
+        metrics = target
+
+    for cls, names in OPERATIONS.items():
+        for name in names:
+            original = cls.__dict__[name]
+            _originals.append((cls, name, original))
+            setattr(cls, name, _wrap(f'{cls.__name__}.{name}', original))
+
+    event.listen(Engine, 'before_cursor_execute', _before_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+
+def disable():
+    """Stops recording and restores the original methods"""
+    while _originals:
+        cls, name, original = _originals.pop()
+        setattr(cls, name, original)
+
+    if event.contains(Engine, 'before_cursor_execute', _before_execute):
+        event.remove(Engine, 'before_cursor_execute', _before_execute)
+        event.remove(Engine, 'after_cursor_execute', _after_execute)
+        event.remove(Engine, 'handle_error', _handle_error)
+
+def _wrap(name, original):
+    """Returns a timed version of a function, staticmethod or classmethod"""
+    if isinstance(original, (staticmethod, classmethod)):
+        return type(original)(_timed(name, original.__func__))
+
+    return _timed(name, original)
+
+def _timed(name, func):
+    if isgeneratorfunction(func):
+        return _timed_generator(name, func)
+
+    @wraps(func)
+    def timed(*args, **kwargs):
+        token = _current.set(name)
+        began = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.record_call(name, perf_counter() - began)
+            _current.reset(token)
+
+    return timed
+
+def _timed_generator(name, func):
+    """Like _timed, but times every step of the iteration and attributes the SQL run while it resumes"""
+    @wraps(func)
+    def timed(*args, **kwargs):
+        generator = func(*args, **kwargs)
+        elapsed = 0.0
+        try:
+            while True:
+                token = _current.set(name)
+                began = perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += perf_counter() - began
+                    _current.reset(token)
+
+                yield item
+        finally:
+            generator.close()
+            metrics.record_call(name, elapsed)
+
+    return timed
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('instrument_started', []).append(perf_counter())
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    began = conn.info['instrument_started'].pop()
+    metrics.record_sql(_current.get(), perf_counter() - began)
+
+def _handle_error(context):
+    # Failed statements never reach after_cursor_execute, so drop their start time
+    started = context.connection.info.get('instrument_started') if context.connection else None
+    if started:
+        started.pop()
+
+def test():
+    from datetime import datetime
+    from account import Account
+    from utils import get_session
+
+    enable()
+    session = get_session()
+    rooms = [Room(num, 'queen', 100) for num in range(1, 11)]
+    guest = Guest(Account(), 'Mike', 'instrument@email.com')
+    Base.save_all(rooms + [guest], session)
+
+    guest.book_stay(Stay(rooms[0], datetime(2023, 8, 1), datetime(2023, 8, 5)))
+    Room.get_all_available(session, datetime(2023, 8, 2))
+    rooms[1].available_on(datetime(2023, 8, 2))
+    streamed = list(Room.stream(session))
+
+    snapshot = metrics.snapshot()
+    print(snapshot['Room.get_all_available']['calls'])              # -> 1
+    print(snapshot['Room.get_all_available']['sql_statements'] > 0)  # -> True
+    print(snapshot['Guest.book_stay']['calls'])                     # -> 1
+    print(len(streamed), snapshot['Base.stream']['sql_statements'] > 0)  # -> 10 True
+    print('hotel_operation_seconds_count{operation="Room.available_on"}' in metrics.prometheus())  # -> True
+
+    disable()
+    session.close()
+
+if __name__ == '__main__': test()
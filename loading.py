@@ -0,0 +1,112 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Named eager-loading profiles for the front desk, payroll and roster use cases
+
+from datetime import datetime, time, timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+from person import Guest, Employee, Manager
+from schedule import Schedule
+from stay import Stay
+
+# Profile name -> mapped class -> loader options applied to queries for that class.
+# Many-to-one relationships are joined in, collections are loaded with one
+# SELECT ... IN per relationship, so the query count doesn't grow with the rows.
+PROFILES = {
+    'front_desk': {
+        Guest: (joinedload(Guest._account), selectinload(Guest._stays).joinedload(Stay._room)),
+        Stay: (joinedload(Stay._room),),
+    },
+    'payroll': {
+        Employee: (selectinload(Employee._schedules).selectinload(Schedule._shifts),),
+    },
+    'roster': {
+        Manager: (selectinload(Manager._employees).selectinload(Employee._schedules).selectinload(Schedule._shifts),),
+    },
+}
+
+def with_profile(stmt, profile):
+    """Returns stmt with the loader options of the named profile for the entities it selects"""
+    if profile is None:
+        return stmt
+
+    entities = [column['entity'] for column in stmt.column_descriptions]
+    options = [option for cls, cls_options in PROFILES[profile].items() if cls in entities for option in cls_options]
+    return stmt.options(*options)
+
+def get_arrivals(session, day, profile='front_desk'):
+    """Returns (guest, stay) pairs for the stays starting on day, ordered by start time"""
+    start = datetime.combine(day, time.min)
+    stmt = select(Guest, Stay).join(Stay, Stay._guest_id == Guest._id).where(
+        Stay._start >= start,
+        Stay._start < start + timedelta(days=1),
+    ).order_by(Stay._start)
+
+    return session.execute(with_profile(stmt, profile)).unique().all()
+
+def get_team(session, manager_id, profile='roster'):
+    """Returns (employee, current schedule) pairs for the employees of a manager"""
+    stmt = with_profile(select(Manager).where(Manager._id == manager_id), profile)
+    manager = session.scalars(stmt).one()
+    return [(emp, emp.get_current_schedule()) for emp in manager.get_employees()]
+
+def get_staff(session, profile='payroll'):
+    """Returns every employee (managers included) with their schedules and shifts"""
+    stmt = with_profile(select(Employee).order_by(Employee._id), profile)
+    return session.scalars(stmt).all()
+
+def test():
+    from datetime import date
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    from account import Account
+    from base import Base
+    from room import Room
+    from utils import get_session
+
+    session = get_session()
+    day = date(2023, 8, 1)
+    guests = []
+    for num in range(1, 1001):
+        guest = Guest(Account(), f'Guest {num}', f'arrival{num}@email.com')
+        guest.book_stay(Stay(Room(num, 'queen', 100), datetime.combine(day, time(15)), datetime(2023, 8, 3)))
+        guests.append(guest)
+    Base.save_all(guests, session)
+
+    manager = Manager(30, 'Jenny', 'roster@email.com')
+    for num in range(20):
+        emp = Employee(20, f'Employee {num}', f'roster{num}@email.com')
+        emp.add_schedule(Schedule(date.today()))
+        manager.add_employee(emp)
+    Base.save_all([manager], session)
+    manager_id = manager._id
+    engine = session.bind
+    session.close()
+
+    queries = []
+    counter = lambda *args: queries.append(1)
+    event.listen(engine, 'before_cursor_execute', counter)
+
+    def count(profile, use):
+        session = Session(engine)
+        queries.clear()
+        use(session, profile)
+        session.close()
+        return len(queries)
+
+    def front_desk(session, profile):
+        for guest, stay in get_arrivals(session, day, profile):
+            guest.get_account().get_total_due(), stay.get_room().get_rate(), len(guest.get_stays())
+
+    def roster(session, profile):
+        for emp, schedule in get_team(session, manager_id, profile):
+            schedule.get_shifts()
+
+    arrivals = count('front_desk', front_desk)
+    print(arrivals)                                  # -> 3
+    assert arrivals <= 5, arrivals
+    print(count(None, front_desk))                   # -> 3001
+    print(count('roster', roster), count(None, roster))  # -> 4 42
+
+    event.remove(engine, 'before_cursor_execute', counter)
+
+if __name__ == '__main__': test()
@@ -0,0 +1,227 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Rooms x nights occupancy matrix for multi-night availability searches
+
+from datetime import datetime, date, timedelta
+from sqlalchemy import select
+from room import Room, Unavailability
+
+class OccupancyMatrix:
+    """
+    Occupancy of every room for a window of nights. Each night is stored as an
+    integer bitset with one bit per room, so availability over a date range, free
+    counts by room type and first-available searches are bitwise operations over
+    whole rows instead of per-room, per-date checks.
+
+    A range [start, end) occupies the nights from start.date() up to but not
+    including end.date(). Register the matrix with Stay.add_observer to keep it
+    up to date as stays are booked, moved and cancelled.
+    """
+
+    def __init__(self, rooms=(), start=None, nights=90):
+        self._start = start or date.today()
+        self._nights = int(nights)
+        self._occupied = [0] * self._nights
+        self._room_numbers = []
+        self._positions = {}
+        self._type_masks = {}
+        self._all_rooms = 0
+
+        for room in rooms:
+            self.add_room(room)
+
+    @classmethod
+    def from_session(cls, session, start=None, nights=90):
+        """Builds a matrix for all rooms in the database using two queries"""
+        matrix = cls(start=start, nights=nights)
+        for room_number, room_type in session.execute(select(Room._room_number, Room._type)):
+            matrix._add_position(room_number, room_type)
+
+        window_start, window_end = matrix._window_datetimes()
+        stmt = select(Unavailability._room_number, Unavailability._start, Unavailability._end).where(
+            Unavailability._start < window_end, Unavailability._end > window_start)
+
+        for room_number, start, end in session.execute(stmt):
+            matrix._set(matrix._positions[room_number], start, end)
+
+        return matrix
+
+    def get_start(self):
+        return self._start
+
+    def get_end(self):
+        return self._start + timedelta(days=self._nights)
+
+    def add_room(self, room):
+        """Adds room to the matrix and marks its unavailable dates"""
+        bit = self._add_position(room.get_room_number(), room.get_type())
+        for start, end in room.get_unavailable_dates().items():
+            self._set(bit, start, end)
+
+    def room_booked(self, room, start, end):
+        """Observer callback for a room becoming unavailable on [start, end)"""
+        bit = self._positions.get(room.get_room_number())
+        if bit is None:
+            self.add_room(room)
+        else:
+            self._set(bit, start, end)
+
+    def room_released(self, room, start, end):
+        """Observer callback for a room becoming available again on [start, end)"""
+        bit = self._positions.get(room.get_room_number())
+        if bit is None: return
+
+        first, last = self._night_range(start, end)
+        mask = ~(1 << bit)
+        for night in range(first, last):
+            self._occupied[night] &= mask
+
+        # Other ranges of the room may share nights with the released one
+        for other_start, other_end in room.get_unavailable_dates().items():
+            if other_start.date() < self._night_date(last) and other_end.date() > self._night_date(first):
+                self._set(bit, other_start, other_end)
+
+    def is_free(self, room_number, start, end=None):
+        """Returns True if the room is free for every night in [start, end)"""
+        bit = self._positions[room_number]
+        return not (self._occupied_mask(start, end) >> bit) & 1
+
+    def free_rooms(self, start, end=None, room_type=None):
+        """Returns the numbers of rooms free for every night in [start, end)"""
+        free = self._free_mask(start, end, room_type)
+        return [self._room_numbers[bit] for bit in _bits(free)]
+
+    def free_counts(self, start, end=None):
+        """Returns a dict of room type -> number of rooms free for every night in [start, end)"""
+        free = self._free_mask(start, end)
+        return {room_type: (free & mask).bit_count() for room_type, mask in self._type_masks.items()}
+
+    def nightly_free_counts(self, start=None, end=None):
+        """Returns a dict of room type -> list of free room counts for each night in [start, end)"""
+        first, last = self._night_range(start or self._start, end or self.get_end())
+        counts = {}
+
+        for room_type, mask in self._type_masks.items():
+            counts[room_type] = [(mask & ~self._occupied[night]).bit_count() for night in range(first, last)]
+
+        return counts
+
+    def first_available(self, nights=1, room_type=None, after=None):
+        """
+        Returns the first date on or after the after parameter (defaults to the start
+        of the matrix) from which a room is free for the given number of nights,
+        along with the numbers of the free rooms. Returns (None, []) if there is none.
+        """
+        candidates = self._type_masks.get(room_type, 0) if room_type else self._all_rooms
+        first = self._night_index(after) if after else 0
+
+        for night in range(max(first, 0), self._nights - nights + 1):
+            occupied = 0
+            for offset in range(nights):
+                occupied |= self._occupied[night + offset]
+
+            free = candidates & ~occupied
+            if free:
+                rooms = [self._room_numbers[bit] for bit in _bits(free)]
+                return self._night_date(night), rooms
+
+        return None, []
+
+    def _add_position(self, room_number, room_type):
+        bit = self._positions.get(room_number)
+        if bit is not None: return bit
+
+        bit = len(self._room_numbers)
+        self._room_numbers.append(room_number)
+        self._positions[room_number] = bit
+        self._type_masks[room_type] = self._type_masks.get(room_type, 0) | (1 << bit)
+        self._all_rooms |= 1 << bit
+        return bit
+
+    def _set(self, bit, start, end):
+        first, last = self._night_range(start, end)
+        flag = 1 << bit
+        for night in range(first, last):
+            self._occupied[night] |= flag
+
+    def _occupied_mask(self, start, end=None):
+        first = self._night_index(start)
+        last = max(self._night_index(end) if end else 0, first + 1)
+        if first < 0 or last > self._nights:
+            raise ValueError('Date range is outside of the occupancy matrix window')
+
+        occupied = 0
+        for night in range(first, last):
+            occupied |= self._occupied[night]
+
+        return occupied
+
+    def _free_mask(self, start, end=None, room_type=None):
+        candidates = self._type_masks.get(room_type, 0) if room_type else self._all_rooms
+        return candidates & ~self._occupied_mask(start, end)
+
+    def _night_index(self, day):
+        if hasattr(day, 'date'):
+            day = day.date()
+        return (day - self._start).days
+
+    def _night_date(self, night):
+        return self._start + timedelta(days=night)
+
+    def _night_range(self, start, end=None):
+        """Returns the [first, last) night indexes for a date range, clipped to the matrix window"""
+        first = self._night_index(start)
+        last = self._night_index(end) if end else first + 1
+        return max(first, 0), min(last, self._nights)
+
+    def _window_datetimes(self):
+        start = datetime.combine(self._start, datetime.min.time())
+        return start, start + timedelta(days=self._nights)
+
+def _bits(mask):
+    """Yields the positions of the set bits in mask, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def test():
+    from stay import Stay
+
+    rooms = [Room(101, 'king', 175), Room(102, 'king', 175), Room(201, 'queen', 150)]
+    matrix = OccupancyMatrix(rooms, date(2023, 8, 1), 30)
+    Stay.add_observer(matrix)
+
+    stay = Stay(rooms[0], datetime(2023, 8, 1), datetime(2023, 8, 5))
+    Stay(rooms[1], datetime(2023, 8, 3), datetime(2023, 8, 4))
+
+    print(matrix.free_rooms(date(2023, 8, 2)))                   # -> [102, 201]
+    print(matrix.free_counts(date(2023, 8, 1), date(2023, 8, 5)))  # -> {'king': 0, 'queen': 1}
+    print(matrix.first_available(3, 'king'))         # -> (datetime.date(2023, 8, 4), [102])
+    print(matrix.nightly_free_counts(date(2023, 8, 3), date(2023, 8, 6))['king'])    # -> [0, 1, 2]
+
+    stay.set_end(datetime(2023, 8, 3))
+    print(matrix.is_free(101, date(2023, 8, 3)))    # -> True
+
+    # Rooms in a session only notify the matrix once their changes commit
+    import person    # stays reference the person table
+    from base import Base
+    from utils import get_session
+
+    session = get_session()
+    room = Room(301, 'queen', 150)
+    Base.save_all([room], session)
+    matrix.add_room(room)
+
+    Stay(room, datetime(2023, 8, 2), datetime(2023, 8, 4))
+    print(matrix.is_free(301, date(2023, 8, 2)))    # -> True
+    session.rollback()
+    print(matrix.is_free(301, date(2023, 8, 2)), room.available_on(datetime(2023, 8, 2)))  # -> True True
+
+    session.add(Stay(room, datetime(2023, 8, 2), datetime(2023, 8, 4)))
+    session.commit()
+    print(matrix.is_free(301, date(2023, 8, 2)))    # -> False
+    session.close()
+
+    Stay.remove_observer(matrix)
+
+if __name__ == '__main__': test()
@@ -0,0 +1,94 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Batch payroll run for all employees over a pay period
+
+from collections import namedtuple
+from sqlalchemy import select, update, func, case
+from person import Employee
+from schedule import Schedule
+
+OVERTIME_THRESHOLD = 40.0
+OVERTIME_MULTIPLIER = 1.5
+
+PayrollLine = namedtuple('PayrollLine', 'employee_id name pay_rate regular_hours overtime_hours total_pay')
+
+def run_payroll(session, period_start, period_end, apply=True):
+    """
+    Computes pay for every employee with a schedule whose week starts in
+    [period_start, period_end) using one aggregate query over the schedules'
+    stored hour totals. Like Employee.apply_schedule_hours, hours past 40 in a
+    schedule count as overtime paid at 1.5 times the pay rate.
+
+    With apply=True the hours are added to each employee's unpaid hours and
+    overtime in one bulk UPDATE. Returns a list of PayrollLine tuples whose
+    total_pay matches Employee.get_total_pay after the hours are applied.
+    """
+    worked = Schedule._hours_worked
+    regular = case((worked > OVERTIME_THRESHOLD, OVERTIME_THRESHOLD), else_=worked)
+    overtime = case((worked > OVERTIME_THRESHOLD, worked - OVERTIME_THRESHOLD), else_=0.0)
+
+    stmt = select(
+        Employee._id,
+        Employee._name,
+        Employee._pay_rate,
+        Employee._unpaid_hours,
+        Employee._unpaid_overtime,
+        func.sum(regular),
+        func.sum(overtime),
+    ).join(Schedule, Schedule._employee_id == Employee._id).where(
+        Schedule._week_start >= period_start,
+        Schedule._week_start < period_end,
+    ).group_by(Employee._id).order_by(Employee._id)
+
+    lines = []
+    changes = []
+
+    for emp_id, name, rate, unpaid, unpaid_overtime, hours, overtime_hours in session.execute(stmt):
+        unpaid = (unpaid or 0.0) + hours
+        unpaid_overtime = (unpaid_overtime or 0.0) + overtime_hours
+        total = (unpaid * rate) + (unpaid_overtime * rate * OVERTIME_MULTIPLIER)
+
+        lines.append(PayrollLine(emp_id, name, rate, hours, overtime_hours, total))
+        changes.append({'_id': emp_id, '_unpaid_hours': unpaid, '_unpaid_overtime': unpaid_overtime})
+
+    if apply and changes:
+        session.execute(update(Employee), changes)
+        _expire_hours(session, {change['_id'] for change in changes})
+
+    return lines
+
+def _expire_hours(session, employee_ids):
+    """Expires unpaid hours on loaded employees so they pick up the bulk UPDATE"""
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Employee) and obj._id in employee_ids:
+            session.expire(obj, ['_unpaid_hours', '_unpaid_overtime'])
+
+def test():
+    from datetime import datetime, date, timedelta
+    from base import Base
+    from schedule import Shift
+    from utils import get_session
+
+    session = get_session()
+    week = date(2023, 8, 7)
+    emp_a = Employee(20, 'Julian', 'payroll_a@email.com')
+    emp_b = Employee(30, 'Jennifer', 'payroll_b@email.com')
+
+    for emp, days in [(emp_a, 4), (emp_b, 6)]:
+        schedule = Schedule(week)
+        for day in range(days):
+            start = datetime(2023, 8, 7 + day, 9)
+            shift = Shift(start, start + timedelta(hours=9))
+            shift.set_real_start(start)
+            shift.set_real_end(start + timedelta(hours=9))
+            schedule.add_shift(shift)
+        emp.add_schedule(schedule)
+
+    Base.save_all([emp_a, emp_b], session)
+    for line in run_payroll(session, week, week + timedelta(days=7)):
+        print(line.name, line.regular_hours, line.overtime_hours, line.total_pay)
+        # -> Julian 36.0 0.0 720.0
+        # -> Jennifer 40.0 14.0 1830.0
+
+    print(emp_b.get_total_pay())    # -> 1830.0
+
+if __name__ == '__main__': test()
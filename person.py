@@ -1,8 +1,9 @@
 # SWDV 630 - Object-Oriented Software Architecture
 # Person superclass and 3 subclasses for a hotel management system
 
-from datetime import datetime, date
-from sqlalchemy import ForeignKey
+from bisect import bisect_right, insort
+from datetime import datetime, date, time, timedelta
+from sqlalchemy import ForeignKey, select
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from base import Base
 from stay import Stay
@@ -77,14 +78,32 @@ class Guest(Person):
         return self._account
     
     def get_stay(self, room_number, start):
-        for stay in self.get_stays():
-            if stay.get_room().get_room_number() == room_number:
-                if stay.get_start().date() == start: 
-                    return stay
+        """Returns the stay in room_number starting on the date start, or None"""
+        key = (room_number, start)
+        stay = self._get_stay_index().get(key)
+
+        # Stays can be moved without the guest knowing (e.g. by Stay.check_in), so a
+        # miss or an outdated entry rebuilds the index once before giving up
+        if stay is None or self._stay_key(stay) != key:
+            stay = self._build_stay_index().get(key)
+
+        return stay
+    
+    def find_stay(self, session, room_number, start):
+        """Looks up the stay in room_number starting on the date start in the database"""
+        day = datetime.combine(start, time.min)
+        stmt = select(Stay).where(
+            Stay._guest_id == self._id,
+            Stay._room_number == room_number,
+            Stay._start >= day,
+            Stay._start < day + timedelta(days=1),
+        )
+        return session.scalars(stmt).first()
     
     def book_stay(self, stay):
         """Adds stay to guest stays and handle account update"""
         self._stays.add(stay)
+        self._get_stay_index()[self._stay_key(stay)] = stay
         account = self.get_account()
         account.charge(stay.get_total_charge())
 
@@ -95,6 +114,7 @@ class Guest(Person):
             account.credit(stay.get_total_charge())
             account.apply_credits()
             
+            self._unindex_stay(stay)
             stay.reset_room()
             self._stays.remove(stay)
 
@@ -104,8 +124,10 @@ class Guest(Person):
             account = self.get_account()
             account.credit(stay.get_total_charge())
 
+            self._unindex_stay(stay)
             if start: stay.set_start(start)
             if end: stay.set_end(end)
+            self._get_stay_index()[self._stay_key(stay)] = stay
 
             account.charge(stay.get_total_charge())
             account.apply_credits()
@@ -116,6 +138,28 @@ class Guest(Person):
        
         return False
 
+    @staticmethod
+    def _stay_key(stay):
+        return (stay.get_room_number(), stay.get_start().date())
+
+    def _get_stay_index(self):
+        """Returns the (room number, start date) -> stay index, rebuilding it if the stays were reloaded"""
+        if getattr(self, '_stay_index_source', None) is not self._stays:
+            self._build_stay_index()
+
+        return self._stay_index
+
+    def _build_stay_index(self):
+        self._stay_index = {self._stay_key(stay): stay for stay in self._stays}
+        self._stay_index_source = self._stays
+        return self._stay_index
+
+    def _unindex_stay(self, stay):
+        index = self._get_stay_index()
+        key = self._stay_key(stay)
+        if index.get(key) is stay:
+            del index[key]
+
 class Employee(Person):
     """Employee subclass for a hotel management system"""
 
@@ -184,19 +228,44 @@ class Employee(Person):
             self.add_hours(hours, overtime)
 
     def add_schedule(self, schedule):
-        self._schedules.add(schedule)
+        index = self._get_schedule_index()
+        if schedule not in self._schedules:
+            self._schedules.add(schedule)
+            insort(index, schedule, key=Schedule.get_week_start)
 
     def remove_schedule(self, schedule):
         if schedule in self.get_all_schedules():
-            self._schedules.pop(schedule)
+            index = self._get_schedule_index()
+            self._schedules.remove(schedule)
+            index.remove(schedule)
 
     def get_current_schedule(self):
-        schedules = self.get_all_schedules()
+        """Returns the schedule whose week includes today, found by bisecting on week start"""
+        schedules = self._get_schedule_index()
         today = date.today()
 
-        for sched in schedules:
-            if sched.get_week_start() <= today <= sched.get_week_end():
-                return sched
+        # Schedules all span one week, so only the latest one starting by today can match
+        idx = bisect_right(schedules, today, key=Schedule.get_week_start) - 1
+        if idx >= 0 and today <= schedules[idx].get_week_end():
+            return schedules[idx]
+
+    def find_current_schedule(self, session):
+        """Looks up the schedule whose week includes today in the database"""
+        today = date.today()
+        stmt = select(Schedule).where(
+            Schedule._employee_id == self._id,
+            Schedule._week_start <= today,
+            Schedule._week_end >= today,
+        ).order_by(Schedule._week_start.desc()).limit(1)
+        return session.scalars(stmt).first()
+
+    def _get_schedule_index(self):
+        """Returns the schedules sorted by week start, rebuilding the list if the schedules were reloaded"""
+        if getattr(self, '_schedule_index_source', None) is not self._schedules:
+            self._schedule_index = sorted(self._schedules, key=Schedule.get_week_start)
+            self._schedule_index_source = self._schedules
+
+        return self._schedule_index
     
 class Manager(Employee):
     """Manager subclass for a hotel management system"""
@@ -271,6 +340,14 @@ def test_manager():
     man.remove_employee(emp_a)
     print(man.get_employees())          # [(Person: Jennifer)]
 
+    # The employee row is inserted before its manager's, so its key is set afterwards
+    from base import Base
+    from utils import get_session
+    session = get_session()
+    Base.save_all([emp_b, man], session, bulk=True)
+    print(session.get(Employee, emp_b._id)._manager_id == man._id)    # True
+    session.close()
+
 def test():
     test_guest()
     print()
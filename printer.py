@@ -1,9 +1,21 @@
 # SWDV 630 - Object-Oriented Software Architecture
 # Mock printer class
 
+import logging
+import queue
+from threading import Lock, Thread
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+class OutOfCardsError(Exception):
+    """Raised when a keycard is requested and no card stock is left"""
+
 class Printer():
     """Mock printer class to simulate printer class for hotel management system"""
     
+    LOW_CARDS = 25
+
     def __init__(self, cards, status='ok'):
         self._remaining_cards = int(cards)
         self._status = status
@@ -21,11 +33,179 @@ class Printer():
         self._status = status
 
     def is_low(self):
-        return self.get_remaining_cards() <= 25
+        return self.get_remaining_cards() <= self.LOW_CARDS
     
     def print_keycard(self, room):
-        print(f'Printing keycard for room {room.get_room_number()}')
-        self._remaining_cards -= 1
+        self.print_keycards([room.get_room_number()])
+
+    def print_keycards(self, room_numbers):
+        """Encodes one keycard for each room number in a single write"""
+        print('\n'.join(f'Printing keycard for room {num}' for num in room_numbers))
+        self._remaining_cards -= len(room_numbers)
+
+class PrintQueue:
+    """
+    Keycard print queue in front of a Printer. print_keycard reserves a card and
+    returns as soon as the job is queued; a worker thread sends queued jobs to the
+    printer in batches of up to batch_size. Card stock is tracked at reservation
+    time, so get_remaining_cards and is_low are accurate while jobs are pending.
+    Jobs in a batch the printer fails on are queued again up to max_retries times,
+    then their cards are given back and the failure listeners are called.
+    Since it has the same print_keycard(room) method, a PrintQueue can be passed to
+    Stay.get_keycard and Stay.replace_keycard in place of a Printer.
+    """
+
+    def __init__(self, printer, batch_size=20, max_retries=3):
+        self._printer = printer
+        self._batch_size = batch_size
+        self._max_retries = max_retries
+        self._cards = printer.get_remaining_cards()
+        self._lock = Lock()
+        self._printer_lock = Lock()
+        self._listeners = []
+        self._failure_listeners = []
+        self._jobs = queue.Queue()
+        self._printed = 0
+        self._batches = 0
+        self._retries = 0
+        self._failures = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+        self._worker = Thread(target=self._run, name='keycard-printer', daemon=True)
+        self._worker.start()
+
+    def get_printer(self):
+        return self._printer
+
+    def get_remaining_cards(self):
+        """Returns the cards left once every queued job is printed"""
+        return self._cards
+
+    def get_depth(self):
+        """Returns the number of jobs waiting to be printed"""
+        return self._jobs.qsize()
+
+    def is_low(self):
+        return self.get_remaining_cards() <= self._printer.LOW_CARDS
+
+    def add_low_stock_listener(self, callback):
+        """Registers callback(print_queue) to be called when the card stock becomes low"""
+        self._listeners.append(callback)
+
+    def add_failure_listener(self, callback):
+        """Registers callback(print_queue, room_numbers, error) to be called for keycards that could not be printed"""
+        self._failure_listeners.append(callback)
+
+    def restock(self, cards):
+        """Adds cards to the printer's stock"""
+        with self._printer_lock:
+            self._printer.set_remaining_cards(self._printer.get_remaining_cards() + cards)
+
+        with self._lock:
+            self._cards += cards
+
+    def print_keycard(self, room):
+        """Reserves a card and queues a keycard for room, raising OutOfCardsError if there is no stock"""
+        with self._lock:
+            if self._cards <= 0:
+                raise OutOfCardsError('No keycards left in the printer')
+
+            was_low = self.is_low()
+            self._cards -= 1
+            became_low = self.is_low() and not was_low
+
+        self._jobs.put((room.get_room_number(), perf_counter(), 0))
+
+        if became_low:
+            for callback in self._listeners:
+                callback(self)
+
+    def join(self):
+        """Blocks until every queued job has been printed"""
+        self._jobs.join()
+
+    def close(self):
+        """Prints the remaining jobs and stops the worker thread"""
+        self._jobs.put(None)
+        self._worker.join()
+
+    def get_stats(self):
+        """Returns a dict with the queue depth, jobs printed, batches, retries, failures and job latency in seconds"""
+        with self._lock:
+            return {
+                'depth': self.get_depth(),
+                'printed': self._printed,
+                'batches': self._batches,
+                'retries': self._retries,
+                'failures': self._failures,
+                'mean_latency': self._latency_total / self._printed if self._printed else 0.0,
+                'max_latency': self._latency_max,
+            }
+
+    def _run(self):
+        while True:
+            batch = [self._jobs.get()]
+            while len(batch) < self._batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is None
+            jobs = [job for job in batch if job is not None]
+            retries = self._print_batch(jobs) if jobs else []
+
+            # Retried jobs go back in the queue, ahead of the stop marker if close() was called
+            for job in retries:
+                self._jobs.put(job)
+            if stop and retries:
+                self._jobs.put(None)
+                stop = False
+
+            for _ in batch:
+                self._jobs.task_done()
+
+            if stop:
+                return
+
+    def _print_batch(self, jobs):
+        """Prints a batch of jobs and returns the jobs to queue again if the printer failed"""
+        try:
+            with self._printer_lock:
+                self._printer.print_keycards([room_number for room_number, _, _ in jobs])
+        except Exception as error:
+            return self._fail_batch(jobs, error)
+
+        done = perf_counter()
+        with self._lock:
+            self._printed += len(jobs)
+            self._batches += 1
+            for _, queued, _ in jobs:
+                latency = done - queued
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+
+        return []
+
+    def _fail_batch(self, jobs, error):
+        retries = [(room_number, queued, attempts + 1) for room_number, queued, attempts in jobs
+                   if attempts < self._max_retries]
+        failed = [room_number for room_number, _, attempts in jobs if attempts >= self._max_retries]
+
+        with self._lock:
+            self._retries += len(retries)
+            self._failures += len(failed)
+            self._cards += len(failed)
+
+        if retries:
+            logger.warning('Printer failed on %d keycards, retrying: %s', len(retries), error)
+        if failed:
+            logger.error('Could not print keycards for rooms %s: %s', failed, error)
+            for callback in self._failure_listeners:
+                callback(self, failed, error)
+
+        return retries
 
 def test():
     from room import Room
@@ -37,4 +217,26 @@ def test():
     printer.print_keycard(test_room)
     print(printer.is_low())    # -> True
 
+    print_queue = PrintQueue(Printer(28))
+    print_queue.add_low_stock_listener(lambda q: print(f'Low stock: {q.get_remaining_cards()} cards'))
+    for _ in range(3):
+        print_queue.print_keycard(test_room)    # -> Low stock: 25 cards (once)
+
+    print_queue.join()
+    stats = print_queue.get_stats()
+    print(stats['printed'], stats['depth'])      # -> 3 0
+    print(print_queue.get_printer().get_remaining_cards())  # -> 25
+    print_queue.close()
+
+    class JammedPrinter(Printer):
+        def print_keycards(self, room_numbers):
+            raise IOError('Card jam')
+
+    print_queue = PrintQueue(JammedPrinter(100), max_retries=2)
+    print_queue.add_failure_listener(lambda q, rooms, error: print(f'Failed: {rooms} ({error})'))
+    print_queue.print_keycard(test_room)    # -> Failed: [101] (Card jam)
+    print_queue.close()
+    stats = print_queue.get_stats()
+    print(stats['retries'], stats['failures'], print_queue.get_remaining_cards())  # -> 2 1 100
+
 if __name__ == '__main__': test()
@@ -0,0 +1,217 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Nightly occupancy, ADR and RevPAR reporting by room type
+
+from collections import namedtuple
+from datetime import datetime, date, timedelta
+from itertools import accumulate
+from sqlalchemy import select, func
+from room import Room
+from stay import Stay
+
+NightlyMetrics = namedtuple('NightlyMetrics', 'date rooms sold revenue occupancy adr revpar')
+
+class OccupancyReport:
+    """
+    Rooms sold and room revenue per night and room type for a window of nights,
+    from which occupancy (sold / rooms), ADR (revenue / sold) and RevPAR
+    (revenue / rooms) are derived for any range inside the window.
+
+    Stays are loaded with one query and expanded into per-night arrays with a
+    difference array per room type (+1 on the first night, -1 after the last,
+    then a running sum), so the cost grows with the number of stays and nights
+    rather than their product. A stay occupies the nights from start.date() up to
+    but not including end.date(), at its room's nightly rate.
+
+    Register the report with Stay.add_observer to have refresh() recompute only
+    the nights touched by stays booked, moved or cancelled since the last run.
+    """
+
+    def __init__(self, start=None, nights=90):
+        self._start = start or date.today()
+        self._nights = int(nights)
+        self._rooms = {}
+        self._sold = {}
+        self._revenue = {}
+        self._dirty = set(range(self._nights))
+
+    def get_start(self):
+        return self._start
+
+    def get_end(self):
+        return self._start + timedelta(days=self._nights)
+
+    def get_room_types(self):
+        return sorted(self._rooms)
+
+    def room_booked(self, room, start, end):
+        """Observer callback marking the nights of [start, end) for recalculation"""
+        self.invalidate(start, end)
+
+    def room_released(self, room, start, end):
+        """Observer callback marking the nights of [start, end) for recalculation"""
+        self.invalidate(start, end)
+
+    def invalidate(self, start=None, end=None):
+        """Marks the nights in [start, end) (the whole window by default) for recalculation, e.g. after a rate change"""
+        first, last = self._night_range(start or self._start, end or self.get_end())
+        self._dirty.update(range(first, last))
+
+    def refresh(self, session):
+        """
+        Recomputes the nights marked for recalculation from the database, querying
+        only the stays that overlap them, and returns the number of nights recomputed.
+        """
+        if not self._dirty:
+            return 0
+
+        first, last = min(self._dirty), max(self._dirty) + 1
+        self._rooms = dict(session.execute(select(Room._type, func.count()).group_by(Room._type)).all())
+
+        sold, revenue = self._expand(session, first, last)
+        for room_type in self._rooms:
+            self._sold.setdefault(room_type, [0] * self._nights)
+            self._revenue.setdefault(room_type, [0.0] * self._nights)
+
+        for room_type in self._sold:
+            new_sold = sold.get(room_type)
+            new_revenue = revenue.get(room_type)
+
+            for night in self._dirty:
+                offset = night - first
+                self._sold[room_type][night] = new_sold[offset] if new_sold else 0
+                self._revenue[room_type][night] = new_revenue[offset] if new_revenue else 0.0
+
+        count = len(self._dirty)
+        self._dirty = set()
+        return count
+
+    def nightly(self, start=None, end=None, room_type=None):
+        """Returns NightlyMetrics for each night in [start, end), for one room type or all rooms"""
+        first, last = self._night_range(start or self._start, end or self.get_end())
+        types = [room_type] if room_type else list(self._sold)
+        metrics = []
+
+        for night in range(first, last):
+            rooms = sum(self._rooms.get(name, 0) for name in types)
+            sold = sum(self._sold[name][night] for name in types if name in self._sold)
+            revenue = sum(self._revenue[name][night] for name in types if name in self._revenue)
+            metrics.append(_metrics(self._night_date(night), rooms, sold, revenue))
+
+        return metrics
+
+    def summary(self, start=None, end=None):
+        """Returns a dict of room type -> NightlyMetrics totalled over [start, end), plus 'all' for the whole hotel"""
+        first, last = self._night_range(start or self._start, end or self.get_end())
+        nights = last - first
+        totals = {}
+
+        for room_type in sorted(self._sold):
+            rooms = self._rooms.get(room_type, 0) * nights
+            sold = sum(self._sold[room_type][first:last])
+            revenue = sum(self._revenue[room_type][first:last])
+            totals[room_type] = _metrics(self._night_date(first), rooms, sold, revenue)
+
+        totals['all'] = _metrics(self._night_date(first), sum(m.rooms for m in totals.values()),
+                                 sum(m.sold for m in totals.values()), sum(m.revenue for m in totals.values()))
+        return totals
+
+    def _expand(self, session, first, last):
+        """Returns dicts of room type -> rooms sold and revenue per night for nights [first, last)"""
+        window_start = datetime.combine(self._night_date(first), datetime.min.time())
+        window_end = datetime.combine(self._night_date(last), datetime.min.time())
+        stmt = select(Stay._start, Stay._end, Room._type, Room._rate).join(Stay._room).where(
+            Stay._start < window_end, Stay._end > window_start)
+
+        size = last - first
+        sold_diff = {}
+        revenue_diff = {}
+
+        for start, end, room_type, rate in session.execute(stmt):
+            begin = max(self._night_index(start) - first, 0)
+            stop = min(self._night_index(end) - first, size)
+            if begin >= stop: continue
+
+            sold = sold_diff.setdefault(room_type, [0] * (size + 1))
+            revenue = revenue_diff.setdefault(room_type, [0.0] * (size + 1))
+            sold[begin] += 1
+            sold[stop] -= 1
+            revenue[begin] += rate
+            revenue[stop] -= rate
+
+        sold = {name: list(accumulate(diff[:size])) for name, diff in sold_diff.items()}
+        revenue = {name: [round(value, 2) for value in accumulate(diff[:size])] for name, diff in revenue_diff.items()}
+        return sold, revenue
+
+    def _night_index(self, day):
+        if hasattr(day, 'date'):
+            day = day.date()
+        return (day - self._start).days
+
+    def _night_date(self, night):
+        return self._start + timedelta(days=night)
+
+    def _night_range(self, start, end):
+        """Returns the [first, last) night indexes for a date range, clipped to the report window"""
+        return max(self._night_index(start), 0), min(self._night_index(end), self._nights)
+
+def _metrics(day, rooms, sold, revenue):
+    occupancy = sold / rooms if rooms else 0.0
+    adr = revenue / sold if sold else 0.0
+    revpar = revenue / rooms if rooms else 0.0
+    return NightlyMetrics(day, rooms, sold, revenue, occupancy, adr, revpar)
+
+def test():
+    import person    # stays reference the person table
+    from base import Base
+    from utils import get_session
+
+    session = get_session()
+    rooms = [Room(1, 'king', 200), Room(2, 'king', 200), Room(3, 'queen', 100), Room(4, 'queen', 100)]
+    Base.save_all(rooms, session)
+
+    stays = [Stay(rooms[0], datetime(2023, 8, 1), datetime(2023, 8, 4)),
+             Stay(rooms[2], datetime(2023, 8, 2), datetime(2023, 8, 3))]
+    session.add_all(stays)
+    session.commit()
+
+    report = OccupancyReport(date(2023, 8, 1), 7)
+    Stay.add_observer(report)
+    print(report.refresh(session))             # -> 7
+
+    night = report.nightly(date(2023, 8, 2), date(2023, 8, 3))[0]
+    print(night.sold, night.occupancy, night.adr, night.revpar)  # -> 2 0.5 150.0 75.0
+
+    king = report.summary(date(2023, 8, 1), date(2023, 8, 4))['king']
+    print(king.sold, king.revenue, king.occupancy)  # -> 3 600.0 0.5
+
+    stays[0].set_end(datetime(2023, 8, 2))
+    session.commit()
+    print(report.refresh(session))             # -> 3
+    print(report.summary(date(2023, 8, 1), date(2023, 8, 4))['king'].sold)  # -> 1
+
+    # Rolled back changes are never reported
+    stays[1].set_end(datetime(2023, 8, 5))
+    session.rollback()
+    print(report.refresh(session))             # -> 0
+    Stay.remove_observer(report)
+
+    # Checking out early frees the remaining nights of the stay
+    today = date.today()
+    report = OccupancyReport(today, 7)
+    Stay.add_observer(report)
+    stay = Stay(rooms[3], datetime.now(), datetime.now() + timedelta(days=3))
+    session.add(stay)
+    stay.check_in()
+    session.commit()
+    report.refresh(session)
+    print(report.summary(today, today + timedelta(days=3))['queen'].sold)  # -> 3
+
+    stay.check_out()
+    session.commit()
+    report.refresh(session)
+    print(report.summary(today, today + timedelta(days=3))['queen'].sold)  # -> 0
+
+    Stay.remove_observer(report)
+    session.close()
+
+if __name__ == '__main__': test()
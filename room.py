@@ -1,12 +1,49 @@
 # SWDV 630 - Object-Oriented Software Architecture
 # Room class
 
-from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy.types import PickleType
-from sqlalchemy.orm.session import make_transient
+from datetime import datetime
+from weakref import WeakKeyDictionary
+from sqlalchemy import ForeignKey, Index, select, exists, update, event
+from sqlalchemy.orm import Mapped, mapped_column, relationship, object_session, Session
 from base import Base
+from availability import IntervalIndex, NightCalendar
 from prototype import Prototype, PrototypeFactory
 
+class Unavailability(Base):
+    """A range of dates [start, end) that a room cannot be booked for"""
+
+    def __init__(self, start, end):
+        self._start = start
+        self._end = end
+
+    __tablename__ = 'room_unavailability'
+    __table_args__ = (
+        Index('ix_room_unavailability_range', '_room_number', '_start', '_end'),
+    )
+
+    _id: Mapped[int] = mapped_column(primary_key=True)
+    _room_number: Mapped[int] = mapped_column(ForeignKey('room._room_number'))
+    _start: Mapped[datetime]
+    _end: Mapped[datetime]
+    _stay_id: Mapped[int] = mapped_column(ForeignKey('stay._id'), nullable=True)
+
+    def get_start(self):
+        return self._start
+    
+    def get_end(self):
+        return self._end
+    
+    def set_end(self, end):
+        self._end = end
+
+    @classmethod
+    def covers(cls, point):
+        """Returns a SQL condition that is true for ranges containing point"""
+        return (cls._start <= point) & (cls._end > point)
+
+    def __repr__(self):
+        return f'<Unavailability: {self._start} to {self._end}>'
+
 class Room(Base, Prototype):
     """Room class for hotel management system"""
     
@@ -14,14 +51,24 @@ class Room(Base, Prototype):
         self._room_number = int(room_num)
         self._type = type
         self._rate = float(rate)
-        self._unavailable_dates = {}
+        self._unavailable = []
+        self._check_type_rate()
 
     __tablename__ = 'room'
 
     _room_number: Mapped[int] = mapped_column(primary_key=True)
     _type: Mapped[str]
     _rate: Mapped[float]
-    _unavailable_dates = mapped_column(PickleType)
+    _unavailable: Mapped[list[Unavailability]] = relationship(cascade='all, delete-orphan')
+
+    # Incremented whenever the rate or availability changes; a flush fails with StaleDataError
+    # if another session changed the room since it was loaded
+    _version: Mapped[int] = mapped_column(default=1)
+    __mapper_args__ = {'version_id_col': _version, 'version_id_generator': False}
+
+    # Engine -> {room type -> rate shared by every room of that type}, filled in when a
+    # transaction that called set_type_rate commits, and read by calculate_total
+    _type_rates = WeakKeyDictionary()
 
     def get_room_number(self):
         return self._room_number
@@ -37,52 +84,179 @@ class Room(Base, Prototype):
     
     def set_rate(self, rate):
         self._rate = float(rate)
+        self._check_type_rate()
+        self._bump_version()
+
+    def _check_type_rate(self):
+        """Drops the cached rates for this room's type if the room no longer matches them"""
+        for rates in self._type_rates.values():
+            cached = rates.get(self._type)
+            if cached is not None and cached != self._rate:
+                del rates[self._type]
+
+    def get_unavailable_dates(self):
+        """Returns a dict mapping the start of each unavailable range to its end"""
+        return {block.get_start(): block.get_end() for block in self._unavailable}
 
     def add_unavailable(self, start, end):
-        self._unavailable_dates[start] = end
+        """
+        Marks [start, end) as unavailable and returns the Unavailability row for it.
+        A range that begins at the same start as an existing one replaces it.
+        """
+        index = self._get_index()
+        block = self._blocks.get(start)
+
+        if block:
+            block.set_end(end)
+        else:
+            block = Unavailability(start, end)
+            self._unavailable.append(block)
+            self._blocks[start] = block
+
+        index.add(start, end)
+        self._bump_version()
+        return block
 
     def remove_unavailable(self, start):
-        del self._unavailable_dates[start]
+        index = self._get_index()
+        block = self._blocks.pop(start)
+        self._unavailable.remove(block)
+        index.remove(start)
+        self._bump_version()
+
+    def _bump_version(self):
+        """Increments the room's version, which is checked against the database row on flush"""
+        self._version = (self._version or 0) + 1
 
     def available_on(self, start_date, end_date=None):
-        for start in self._unavailable_dates:
-            end = self._unavailable_dates[start]
+        index = self._get_index()
 
-            if start_date >= start and start_date < end:
-                return False
-            
-            if end_date and (end_date >= start and end_date < end):
-                return False
+        if index.covers(start_date):
+            return False
+        
+        if end_date and index.covers(end_date):
+            return False
             
         return True
 
+    def _get_index(self):
+        """Returns the interval index for unavailable dates, rebuilding it if the rows were reloaded"""
+        blocks = self._unavailable
+        if getattr(self, '_index_source', None) is not blocks:
+            self._blocks = {block.get_start(): block for block in blocks}
+            self._index = IntervalIndex((start, block.get_end()) for start, block in self._blocks.items())
+            self._index_source = blocks
+
+        return self._index
+
+    def get_calendar(self, epoch):
+        """
+        Returns a compact NightCalendar of the room's unavailable nights from epoch on.
+        Ranges that begin before epoch are clipped to it, as in load_calendars.
+        """
+        first = datetime.combine(epoch, datetime.min.time())
+        ranges = [(max(start, first), end) for start, end in self.get_unavailable_dates().items() if end > first]
+        return NightCalendar(epoch, ranges)
+
+    @classmethod
+    def load_calendars(cls, session, epoch):
+        """
+        Returns a dict of room number -> NightCalendar for every room, built from two
+        column queries (room numbers, then ranges) without loading Room or Unavailability
+        instances, for keeping the whole inventory in memory. Ranges that begin before
+        epoch are clipped to it.
+        """
+        first = datetime.combine(epoch, datetime.min.time())
+        calendars = {number: NightCalendar(epoch) for number in session.scalars(select(cls._room_number))}
+        stmt = select(Unavailability._room_number, Unavailability._start, Unavailability._end).where(
+            Unavailability._end > first)
+
+        for number, start, end in session.execute(stmt):
+            calendars[number].add_unavailable(max(start, first), end)
+
+        return calendars
+
+    def clone(self):
+        """
+        Returns a new transient Room with the same number, type and rate as self.
+        Only the mapped columns are copied; the clone has no ORM state or bookings.
+        """
+        return Room(self._room_number, self._type, self._rate)
+
     def calculate_total(self, num_days):
-        return self._rate * num_days
+        """Returns the charge for num_days nights at the rate of the room's type if it is cached"""
+        rate = None
+        session = object_session(self)
+        if session is not None:
+            rate = session.info.get('room_type_rates', {}).get(self._type)
+            if rate is None:
+                rate = self.get_type_rate(self._type, session)
+
+        return (self._rate if rate is None else rate) * num_days
     
     @classmethod
     def get_all_available(cls, session, start_date, end_date=None):
-        rooms = cls.get_all(session)
-        return [room for room in rooms if room.available_on(start_date, end_date)]
+        """Returns all rooms available on the given dates, filtered in SQL with an anti-join"""
+        overlaps = Unavailability.covers(start_date)
+        if end_date:
+            overlaps = overlaps | Unavailability.covers(end_date)
+
+        blocked = exists().where(Unavailability._room_number == cls._room_number, overlaps)
+        stmt = select(cls).where(~blocked)
+        return session.scalars(stmt).all()
     
     @classmethod
     def set_type_rate(cls, type, new_rate, session):
-        rooms = cls.get_all(session)
-        
-        for room in rooms:
-            if room.get_type() == type:
-                room.set_rate(new_rate)
+        """
+        Sets the rate of every room of a type with one UPDATE, also updating rooms
+        loaded in session. The rate is cached for calculate_total once session commits.
+        """
+        new_rate = float(new_rate)
+        stmt = update(cls).where(cls._type == type).values(_rate=new_rate, _version=cls._version + 1)
+        session.execute(stmt, execution_options={'synchronize_session': 'evaluate'})
+        session.info.setdefault('room_type_rates', {})[type] = new_rate
+
+    @classmethod
+    def get_type_rate(cls, type, session):
+        """Returns the committed rate shared by all rooms of a type in session's database, or None if it is not known"""
+        return cls._type_rates.get(session.get_bind(), {}).get(type)
     
     def __repr__(self):
         return f'<Room {self._room_number}: ${self._rate:.2f}>'
     
+@event.listens_for(Session, 'after_commit')
+def _commit_type_rates(session):
+    rates = session.info.pop('room_type_rates', None)
+    if rates:
+        Room._type_rates.setdefault(session.get_bind(), {}).update(rates)
+
+@event.listens_for(Session, 'after_transaction_end')
+def _discard_type_rates(session, transaction):
+    # Covers rollbacks and sessions closed without committing
+    if transaction.parent is None:
+        session.info.pop('room_type_rates', None)
+
 class RoomFactory(PrototypeFactory):
     def register(self, key, room):
         if type(room) == Room:
-            room_clone = room.clone()
-            make_transient(room_clone)
-            return super().register(key, room_clone)
+            return super().register(key, room.clone())
         
         return False
+
+    def provision(self, key, room_numbers, session=None):
+        """
+        Returns new rooms numbered room_numbers, built from the template at registry[key].
+        If session is given, the rooms are inserted with a single bulk INSERT.
+        """
+        template = self._registry[key]
+        room_type = template.get_type()
+        rate = template.get_rate()
+        rooms = [Room(num, room_type, rate) for num in room_numbers]
+
+        if session is not None and rooms:
+            Base.save_all(rooms, session, bulk=True, batch_size=len(rooms))
+
+        return rooms
     
 def test():
     from datetime import datetime
@@ -95,4 +269,34 @@ def test():
     print(room.available_on(datetime(2023, 8, 4), datetime(2023, 8, 8)))    # -> False
     print(room.available_on(datetime(2023, 8, 5), datetime(2023, 8, 8)))    # -> True
 
+    room.add_unavailable(datetime(2023, 7, 1), datetime(2023, 7, 10))
+    print(room.available_on(datetime(2023, 7, 3)))    # -> False
+    room.remove_unavailable(datetime(2023, 7, 1))
+    print(room.available_on(datetime(2023, 7, 3)))    # -> True
+
+    calendar = room.get_calendar(datetime(2023, 1, 1).date())
+    print(calendar.available_on(datetime(2023, 8, 3)))    # -> False
+    calendar = room.get_calendar(datetime(2023, 8, 3).date())
+    print(calendar.available_on(datetime(2023, 8, 4)))    # -> False
+
+    # Only the room table is needed; its ranges reference stays, which import this module
+    from sqlalchemy import create_engine
+    engine = create_engine('sqlite+pysqlite:///:memory:')
+    Base.metadata.create_all(engine, tables=[Room.__table__])
+    session = Session(engine)
+    session.add_all([Room(1, 'queen', 100), Room(2, 'queen', 100)])
+    session.commit()
+
+    Room.set_type_rate('queen', 50, session)
+    session.rollback()
+    room = session.get(Room, 1)
+    print(room.calculate_total(2), Room.get_type_rate('queen', session))    # -> 200.0 None
+    Room.set_type_rate('queen', 90, session)
+    print(room.calculate_total(2), Room.get_type_rate('queen', session))    # -> 180.0 None
+    session.commit()
+    print(room.calculate_total(2), Room.get_type_rate('queen', session))    # -> 180.0 90.0
+    room.set_rate(120)
+    print(room.calculate_total(2), Room.get_type_rate('queen', session))    # -> 240.0 None
+    session.close()
+
 if __name__ == '__main__': test()
@@ -1,7 +1,7 @@
 # SWDV 630 - Object-Oriented Software Architecture
 
-from datetime import datetime, date, timedelta
-from sqlalchemy import ForeignKey
+from datetime import datetime, date, time, timedelta
+from sqlalchemy import ForeignKey, Index, select
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from base import Base
 from utils import calculate_hours
@@ -17,6 +17,9 @@ class Shift(Base):
         self._clocked_in = False
 
     __tablename__ = 'shift'
+    __table_args__ = (
+        Index('ix_shift_schedule_start', '_schedule_id', '_start'),
+    )
 
     _id: Mapped[int] = mapped_column(primary_key=True)
     _start: Mapped[datetime]
@@ -25,6 +28,7 @@ class Shift(Base):
     _end_actual: Mapped[datetime] = mapped_column(nullable=True)
     _clocked_in: Mapped[bool]
     _schedule_id: Mapped[int] = mapped_column(ForeignKey('schedule._id'), nullable=True)
+    _schedule: Mapped['Schedule'] = relationship(back_populates='_shifts')
 
     def is_clocked_in(self):
         return self._clocked_in
@@ -42,33 +46,60 @@ class Shift(Base):
         return self._end_actual
     
     def set_start(self, start):
+        totals = self.get_totals()
         self._start = start
+        self._update_schedule(totals)
 
     def set_end(self, end):
+        totals = self.get_totals()
         self._end = end
+        self._update_schedule(totals)
 
     def set_real_start(self, start):
+        totals = self.get_totals()
         self._start_actual = start
+        self._update_schedule(totals)
 
     def set_real_end(self, end):
+        totals = self.get_totals()
         self._end_actual = end
+        self._update_schedule(totals)
 
-    def clock_in(self):
+    def clock_in(self, at=None):
         if not self.is_clocked_in(): 
+            totals = self.get_totals()
             self._clocked_in = True
-            self.set_real_start(datetime.now())
+            self._start_actual = at or datetime.now()
+            self._update_schedule(totals)
             return True
         
         return False
     
-    def clock_out(self):
+    def clock_out(self, at=None):
         if self.is_clocked_in():
+            totals = self.get_totals()
             self._clocked_in = False
-            self.set_real_end(datetime.now())
+            self._end_actual = at or datetime.now()
+            self._update_schedule(totals)
             return True
         
         return False
 
+    def get_totals(self):
+        """Returns what the shift adds to its schedule's (hours scheduled, hours worked, clocked in) totals"""
+        worked = 0.0
+        if self.get_real_start() and self.get_real_end():
+            worked = self.hours_worked()
+
+        return self.hours_scheduled(), worked, int(self.is_clocked_in())
+
+    def _update_schedule(self, totals):
+        """Replaces the shift's old totals with its current ones in its schedule"""
+        schedule = self._schedule
+        if schedule is not None:
+            schedule._add_totals(totals, -1)
+            schedule._add_totals(self.get_totals())
+
     def hours_scheduled(self):
         return calculate_hours(self.get_start(), self.get_end())
     
@@ -88,15 +119,26 @@ class Schedule(Base):
         self._shifts = []
         self._week_start = week_start
         self._week_end = week_start + timedelta(days=7)
+        self._hours_scheduled = 0.0
+        self._hours_worked = 0.0
+        self._clocked_in_count = 0
 
     __tablename__ = 'schedule'
+    __table_args__ = (
+        Index('ix_schedule_employee_week', '_employee_id', '_week_start'),
+    )
 
     _id: Mapped[int] = mapped_column(primary_key=True)
-    _shifts: Mapped[list[Shift]] = relationship()
+    _shifts: Mapped[list[Shift]] = relationship(back_populates='_schedule')
     _week_start: Mapped[date]
     _week_end: Mapped[date]
     _employee_id: Mapped[int] = mapped_column(ForeignKey('person._id'), nullable=True)
 
+    # Running totals over all shifts, kept up to date by the shifts themselves
+    _hours_scheduled: Mapped[float] = mapped_column(default=0.0)
+    _hours_worked: Mapped[float] = mapped_column(default=0.0)
+    _clocked_in_count: Mapped[int] = mapped_column(default=0)
+
     def get_shifts(self):
         return self._shifts[:]
     
@@ -107,41 +149,88 @@ class Schedule(Base):
         return self._week_end
     
     def get_current_shift(self):
-        for shift in self._shifts:
-            if shift.get_start().date() == date.today():
-                return shift
+        """Returns the first shift starting today, looked up by date"""
+        today = date.today()
+        shift = self._get_shift_index().get(today)
+
+        # Shift start times can be changed after they are added, so a miss or an
+        # outdated entry rebuilds the index once before giving up
+        if shift is None or shift.get_start().date() != today:
+            shift = self._build_shift_index().get(today)
+
+        return shift
+    
+    def find_current_shift(self, session):
+        """Looks up the first shift starting today in the database"""
+        today = datetime.combine(date.today(), time.min)
+        stmt = select(Shift).where(
+            Shift._schedule_id == self._id,
+            Shift._start >= today,
+            Shift._start < today + timedelta(days=1),
+        ).order_by(Shift._id).limit(1)
+        return session.scalars(stmt).first()
     
     def add_shift(self, shift):
         if type(shift) == Shift:
+            if shift._schedule is not None:
+                shift._schedule.remove_shift(shift)
+
             self._shifts.append(shift)
+            self._add_totals(shift.get_totals())
+            self._get_shift_index().setdefault(shift.get_start().date(), shift)
 
     def remove_shift(self, shift):
         shift_idx = self._shifts.index(shift)
         self._shifts.pop(shift_idx)
+        self._add_totals(shift.get_totals(), -1)
 
-    def hours_scheduled(self):
-        total = 0.0
+        if self._get_shift_index().get(shift.get_start().date()) is shift:
+            self._build_shift_index()
+
+    def _get_shift_index(self):
+        """Returns the date -> first shift index, rebuilding it if the shifts were replaced"""
+        if getattr(self, '_shift_index_source', None) is not self._shifts:
+            self._build_shift_index()
+
+        return self._shift_index
+
+    def _build_shift_index(self):
+        self._shift_index = {}
         for shift in self._shifts:
-            total += shift.hours_scheduled()
+            self._shift_index.setdefault(shift.get_start().date(), shift)
 
-        return total
+        self._shift_index_source = self._shifts
+        return self._shift_index
+
+    def hours_scheduled(self):
+        return self._hours_scheduled
     
     def hours_worked(self):
-        total = 0.0
-        for shift in self._shifts:
-            total += shift.hours_worked()
-
-        return total
+        return self._hours_worked
     
     def is_clocked_in(self):
-        for shift in self._shifts:
-            if shift.is_clocked_in():
-                return True
-            
-        return False
+        return self._clocked_in_count > 0
     
     def reset(self):
         self._shifts = []
+        self._hours_scheduled = 0.0
+        self._hours_worked = 0.0
+        self._clocked_in_count = 0
+
+    def recalculate(self):
+        """Recomputes the running totals from the shifts, e.g. to clear float rounding drift"""
+        self._hours_scheduled = 0.0
+        self._hours_worked = 0.0
+        self._clocked_in_count = 0
+
+        for shift in self._shifts:
+            self._add_totals(shift.get_totals())
+
+    def _add_totals(self, totals, sign=1):
+        scheduled, worked, clocked_in = totals
+        self._hours_scheduled += sign * scheduled
+        self._hours_worked += sign * worked
+        self._clocked_in_count += sign * clocked_in
 
     def __repr__(self):
         return f'<Schedule ({self.get_week_start()} to {self.get_week_end()}): {len(self._shifts)} Shifts>'
\ No newline at end of file
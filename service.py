@@ -0,0 +1,145 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Asyncio service facade for booking and availability use cases
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from person import Guest
+from room import Room
+from stay import Stay
+from utils import get_session_factory
+
+class HotelService:
+    """
+    Exposes the booking and availability use cases as coroutines. Each call runs
+    in a worker thread with its own session from the shared engine for the
+    database at path, and at most max_concurrency calls run at the same time.
+    Results are plain values (room numbers, ids, booleans) rather than ORM
+    instances, since the session is closed once the call returns.
+    """
+
+    def __init__(self, path, max_concurrency=16):
+        self._factory = get_session_factory(path)
+        self._max_concurrency = max_concurrency
+        self._limit = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def available_rooms(self, start, end=None):
+        """Returns the numbers of all rooms available on the given dates"""
+        return await self._run(_available_rooms, start, end)
+
+    async def book_stay(self, guest_id, room_number, start, end):
+        """Books room_number for the guest and returns the new stay id"""
+        return await self._run(_book_stay, guest_id, room_number, start, end)
+
+    async def cancel_stay(self, guest_id, stay_id):
+        return await self._run(_cancel_stay, guest_id, stay_id)
+
+    async def alter_stay(self, guest_id, stay_id, start=None, end=None):
+        return await self._run(_alter_stay, guest_id, stay_id, start, end)
+
+    async def check_in(self, stay_id):
+        return await self._run(lambda session: session.get(Stay, stay_id).check_in())
+
+    async def check_out(self, stay_id):
+        return await self._run(lambda session: session.get(Stay, stay_id).check_out())
+
+    def get_max_concurrency(self):
+        return self._max_concurrency
+
+    def close(self):
+        self._executor.shutdown()
+
+    async def _run(self, func, *args):
+        async with self._limit:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._call, func, args)
+
+    def _call(self, func, args):
+        """Runs func with a thread-local session, committing on success and rolling back on error"""
+        session = self._factory()
+        try:
+            result = func(session, *args)
+            session.commit()
+            return result
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            self._factory.remove()
+
+def _available_rooms(session, start, end):
+    return [room.get_room_number() for room in Room.get_all_available(session, start, end)]
+
+def _book_stay(session, guest_id, room_number, start, end):
+    guest = session.get(Guest, guest_id)
+    stay = Stay(session.get(Room, room_number), start, end)
+    guest.book_stay(stay)
+    session.flush()
+    return stay._id
+
+def _cancel_stay(session, guest_id, stay_id):
+    guest = session.get(Guest, guest_id)
+    guest.cancel_stay(session.get(Stay, stay_id))
+    return True
+
+def _alter_stay(session, guest_id, stay_id, start, end):
+    guest = session.get(Guest, guest_id)
+    guest.alter_stay(session.get(Stay, stay_id), start, end)
+    return True
+
+async def benchmark(service, checks=2000):
+    """Compares availability checks per second for the sync path and the async facade"""
+    from datetime import datetime, timedelta
+
+    dates = [datetime(2023, 8, 1) + timedelta(days=i % 60) for i in range(checks)]
+
+    began = perf_counter()
+    for day in dates:
+        service._call(_available_rooms, (day, day + timedelta(days=2)))
+    sync_rate = checks / (perf_counter() - began)
+
+    began = perf_counter()
+    await asyncio.gather(*(service.available_rooms(day, day + timedelta(days=2)) for day in dates))
+    async_rate = checks / (perf_counter() - began)
+
+    return {
+        'checks': checks,
+        'max_concurrency': service.get_max_concurrency(),
+        'sync_per_sec': sync_rate,
+        'async_per_sec': async_rate,
+    }
+
+def test():
+    import os
+    import tempfile
+    from datetime import datetime
+    from account import Account
+    from base import Base
+    from utils import get_session, dispose_engines
+
+    path = os.path.join(tempfile.mkdtemp(), 'service.db')
+    session = get_session(path=path)
+    guest = Guest(Account(), 'Mike', 'service@email.com')
+    Base.save_all([Room(i, 'queen', 100) for i in range(1, 51)] + [guest], session)
+    guest_id = guest._id
+    session.close()
+
+    async def run():
+        service = HotelService(path)
+
+        stay_id = await service.book_stay(guest_id, 1, datetime(2023, 8, 1), datetime(2023, 8, 5))
+        rooms = await service.available_rooms(datetime(2023, 8, 2))
+        print(1 in rooms, len(rooms))                 # -> False 49
+
+        await service.alter_stay(guest_id, stay_id, end=datetime(2023, 8, 3))
+        print(await service.check_in(stay_id))        # -> True
+        print(await service.check_out(stay_id))       # -> True
+
+        print(await benchmark(service, checks=1000))
+        service.close()
+
+    asyncio.run(run())
+    dispose_engines()
+
+if __name__ == '__main__': test()
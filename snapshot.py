@@ -0,0 +1,424 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Memory-mapped binary snapshot of the domain state for fast worker start-up
+
+import mmap
+import os
+import struct
+from collections import namedtuple
+from datetime import datetime, date, timedelta
+from sqlalchemy import select, func
+from account import Account, AccountTransaction
+from availability import IntervalIndex
+from person import Guest
+from room import Room, Unavailability
+from schedule import Schedule
+from stay import Stay
+
+MAGIC = b'HOTELSNP'
+FORMAT_VERSION = 1
+SECTIONS = ('types', 'rooms', 'ranges', 'stays', 'accounts', 'schedules')
+
+# Little-endian fixed-size records; times are microseconds since EPOCH, dates are ordinals
+HEADER = struct.Struct('<8sIdq' + 'QQ' * len(SECTIONS))
+ROOM = struct.Struct('<qHdqII')          # number, type index, rate, version, first range, range count
+RANGE = struct.Struct('<qqqq')           # start, end, running max of the room's ends, stay id or -1
+STAY = struct.Struct('<qqqqq?')          # id, room number, guest id or -1, start, end, checked in
+ACCOUNT = struct.Struct('<qqqq')         # id, amount due in cents, credits in cents, transaction count
+SCHEDULE = struct.Struct('<qqiddi')      # id, employee id or -1, week start, hours scheduled, hours worked, clocked in
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+RoomRecord = namedtuple('RoomRecord', 'room_number type rate version')
+StayRecord = namedtuple('StayRecord', 'id room_number guest_id start end checked_in')
+AccountRecord = namedtuple('AccountRecord', 'id total_due_cents credits_cents transaction_count')
+ScheduleRecord = namedtuple('ScheduleRecord', 'id employee_id week_start hours_scheduled hours_worked clocked_in')
+
+def write_snapshot(session, path, as_of=None, chunk_size=10000):
+    """
+    Writes rooms with their unavailable ranges, stays that haven't ended by as_of
+    (defaults to now), account balances and the schedules of the week containing
+    as_of to a snapshot file at path, streaming each table in key order.
+    The file is written next to path and moved into place once it is complete.
+    Returns the number of records written.
+    """
+    as_of = as_of or datetime.now()
+    temp_path = path + '.tmp'
+    offsets = {}
+    records = 0
+
+    def stream(stmt):
+        result = session.execute(stmt, execution_options={'yield_per': chunk_size})
+        for chunk in result.partitions():
+            yield from chunk
+
+    with open(temp_path, 'wb') as file:
+        file.write(bytes(HEADER.size))
+
+        types = sorted(session.scalars(select(Room._type).distinct()))
+        type_index = {name: idx for idx, name in enumerate(types)}
+        data = '\n'.join(types).encode()
+        offsets['types'] = (file.tell(), len(data))
+        file.write(data)
+
+        # Ranges are written first, so each room can record where its ranges begin
+        counts = {}
+        ranges_offset = file.tell()
+        stmt = select(Unavailability._room_number, Unavailability._start, Unavailability._end,
+                      Unavailability._stay_id).order_by(Unavailability._room_number, Unavailability._start)
+        max_end = None
+        previous = None
+        for room_number, start, end, stay_id in stream(stmt):
+            if room_number != previous:
+                max_end, previous = end, room_number
+            max_end = max(max_end, end)
+            counts[room_number] = counts.get(room_number, 0) + 1
+            file.write(RANGE.pack(_micros(start), _micros(end), _micros(max_end), _or_none(stay_id)))
+        offsets['ranges'] = (ranges_offset, sum(counts.values()))
+
+        first = 0
+        rooms_offset = file.tell()
+        stmt = select(Room._room_number, Room._type, Room._rate, Room._version).order_by(Room._room_number)
+        for room_number, type, rate, version in stream(stmt):
+            count = counts.get(room_number, 0)
+            file.write(ROOM.pack(room_number, type_index[type], rate, version, first, count))
+            first += count
+            records += 1
+        offsets['rooms'] = (rooms_offset, records)
+
+        stmt = select(Stay._id, Stay._room_number, Stay._guest_id, Stay._start, Stay._end, Stay._checked_in).where(
+            Stay._end >= as_of).order_by(Stay._id)
+        offsets['stays'] = _write_section(file, stream(stmt), lambda row: STAY.pack(
+            row[0], row[1], _or_none(row[2]), _micros(row[3]), _micros(row[4]), bool(row[5])))
+
+        stmt = select(Account._id, Account._total_due_cents, Account._credits_cents,
+                      Account._transaction_count).order_by(Account._id)
+        offsets['accounts'] = _write_section(file, stream(stmt), lambda row: ACCOUNT.pack(*row))
+
+        offsets['schedules'] = _write_section(file, stream(_current_schedules(as_of.date())), lambda row: SCHEDULE.pack(
+            row[0], _or_none(row[1]), row[2].toordinal(), row[3], row[4], row[5]))
+
+        max_transaction = session.scalar(select(func.max(AccountTransaction._id))) or 0
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, as_of.timestamp(), max_transaction,
+                               *[value for name in SECTIONS for value in offsets[name]]))
+
+    os.replace(temp_path, path)
+    return records + sum(offsets[name][1] for name in SECTIONS[2:])
+
+def _write_section(file, rows, pack):
+    offset = file.tell()
+    count = 0
+    for row in rows:
+        file.write(pack(row))
+        count += 1
+    return offset, count
+
+def _current_schedules(today):
+    return select(Schedule._id, Schedule._employee_id, Schedule._week_start, Schedule._hours_scheduled,
+                  Schedule._hours_worked, Schedule._clocked_in_count).where(
+        Schedule._week_start <= today, Schedule._week_end >= today).order_by(Schedule._id)
+
+class Snapshot:
+    """
+    Read-only view of a snapshot file mapped into memory. Nothing is decoded up
+    front: rooms and accounts are found by binary search over their fixed-size
+    records, and availability checks bisect the room's ranges in place using the
+    running maximum of their ends stored with each range.
+
+    replay(session) brings the view up to date from the database: rooms whose
+    type, rate or version changed (every booking, move or cancellation bumps
+    the version) are reloaded with their ranges, ledger transactions newer than
+    the snapshot are added to the account balances, and the active stays and
+    current schedules are reloaded. Replay can be repeated to keep a
+    long-running worker current.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = HEADER.unpack_from(self._map, 0)
+        if header[0] != MAGIC or header[1] != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a version {FORMAT_VERSION} snapshot')
+
+        self._as_of = datetime.fromtimestamp(header[2])
+        self._max_transaction = header[3]
+        self._sections = {name: header[4 + 2 * idx:6 + 2 * idx] for idx, name in enumerate(SECTIONS)}
+
+        offset, size = self._sections['types']
+        self._types = self._map[offset:offset + size].decode().split('\n') if size else []
+
+        self._rooms = {}
+        self._deleted_rooms = set()
+        self._account_deltas = {}
+        self._stays = None
+        self._schedules = None
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def get_as_of(self):
+        """Returns the time the snapshot's active stays and current schedules were taken as of"""
+        return self._as_of
+
+    def get_room(self, room_number):
+        """Returns the RoomRecord for room_number, or None if there is no such room"""
+        if room_number in self._rooms:
+            return self._rooms[room_number][0]
+        if room_number in self._deleted_rooms:
+            return None
+
+        idx = self._find('rooms', ROOM, room_number)
+        return None if idx is None else self._room_record(idx)
+
+    def get_room_numbers(self):
+        offset, count = self._sections['rooms']
+        numbers = {ROOM.unpack_from(self._map, offset + idx * ROOM.size)[0] for idx in range(count)}
+        return sorted((numbers | set(self._rooms)) - self._deleted_rooms)
+
+    def get_unavailable_dates(self, room_number):
+        """Returns a dict mapping the start of each unavailable range of the room to its end"""
+        if room_number in self._rooms:
+            return dict(self._rooms[room_number][1])
+
+        return {_datetime(start): _datetime(end) for start, end, _, _ in self._ranges(room_number)}
+
+    def available_on(self, room_number, start_date, end_date=None):
+        """Same check as Room.available_on, for the room as of the snapshot plus replayed changes"""
+        if self._covers(room_number, start_date):
+            return False
+
+        if end_date and self._covers(room_number, end_date):
+            return False
+
+        return True
+
+    def get_account(self, account_id):
+        """Returns the AccountRecord for account_id, or None if it has no balance in the snapshot or since"""
+        idx = self._find('accounts', ACCOUNT, account_id)
+        record = [account_id, 0, 0, 0] if idx is None else list(self._unpack('accounts', ACCOUNT, idx))
+
+        delta = self._account_deltas.get(account_id)
+        if delta:
+            record[1:] = [value + change for value, change in zip(record[1:], delta)]
+        elif idx is None:
+            return None
+
+        return AccountRecord(*record)
+
+    def get_stays(self):
+        """Returns StayRecords of the stays that had not ended as of the snapshot, ordered by id"""
+        if self._stays is not None:
+            return list(self._stays)
+
+        offset, count = self._sections['stays']
+        return [self._stay_record(STAY.unpack_from(self._map, offset + idx * STAY.size)) for idx in range(count)]
+
+    def get_schedules(self):
+        """Returns ScheduleRecords of the schedules for the week containing as_of ordered by id"""
+        if self._schedules is not None:
+            return list(self._schedules)
+
+        offset, count = self._sections['schedules']
+        return [self._schedule_record(SCHEDULE.unpack_from(self._map, offset + idx * SCHEDULE.size)) for idx in range(count)]
+
+    def replay(self, session, chunk_size=500):
+        """
+        Applies the changes made in the database since the snapshot (or the last
+        replay) and returns how many rooms changed. Without a change log, finding
+        changed and deleted rooms takes one streamed pass over the room columns.
+        """
+        changed = []
+        existing = set()
+        stmt = select(Room._room_number, Room._type, Room._rate, Room._version)
+        result = session.execute(stmt, execution_options={'yield_per': chunk_size})
+        for row in (row for chunk in result.partitions() for row in chunk):
+            existing.add(row[0])
+            if self.get_room(row[0]) != RoomRecord(*row):
+                changed.append(row[0])
+
+        for room_number in self.get_room_numbers():
+            if room_number not in existing:
+                self._rooms.pop(room_number, None)
+                self._deleted_rooms.add(room_number)
+
+        for idx in range(0, len(changed), chunk_size):
+            self._reload_rooms(session, changed[idx:idx + chunk_size])
+
+        stmt = select(AccountTransaction._account_id, func.sum(AccountTransaction._due_cents),
+                      func.sum(AccountTransaction._credit_cents), func.count(), func.max(AccountTransaction._id)).where(
+            AccountTransaction._id > self._max_transaction).group_by(AccountTransaction._account_id)
+        for account_id, due, credits, count, last in session.execute(stmt):
+            delta = self._account_deltas.get(account_id, (0, 0, 0))
+            self._account_deltas[account_id] = (delta[0] + due, delta[1] + credits, delta[2] + count)
+            self._max_transaction = max(self._max_transaction, last)
+
+        # Check-outs and guest changes don't bump the room version, so every active stay is re-read
+        stmt = select(Stay._id, Stay._room_number, Stay._guest_id, Stay._start, Stay._end, Stay._checked_in).where(
+            Stay._end >= self._as_of).order_by(Stay._id)
+        self._stays = [StayRecord(*row) for row in session.execute(stmt)]
+
+        rows = session.execute(_current_schedules(self._as_of.date()))
+        self._schedules = [self._schedule_record((*row[:2], row[2].toordinal(), *row[3:])) for row in rows]
+        return len(changed)
+
+    def _reload_rooms(self, session, numbers):
+        stmt = select(Room._room_number, Room._type, Room._rate, Room._version).where(Room._room_number.in_(numbers))
+        rooms = {row[0]: (RoomRecord(*row), {}) for row in session.execute(stmt)}
+
+        stmt = select(Unavailability._room_number, Unavailability._start, Unavailability._end).where(
+            Unavailability._room_number.in_(numbers))
+        for room_number, start, end in session.execute(stmt):
+            rooms[room_number][1][start] = end
+
+        for room_number, (record, ranges) in rooms.items():
+            self._rooms[room_number] = (record, ranges, IntervalIndex(ranges.items()))
+            self._deleted_rooms.discard(room_number)
+
+    def _covers(self, room_number, point):
+        if room_number in self._rooms:
+            return self._rooms[room_number][2].covers(point)
+
+        idx = None if room_number in self._deleted_rooms else self._find('rooms', ROOM, room_number)
+        if idx is None:
+            raise KeyError(room_number)
+
+        _, _, _, _, first, count = self._unpack('rooms', ROOM, idx)
+        offset = self._sections['ranges'][0] + first * RANGE.size
+        point = _micros(point)
+
+        # Last range starting at or before point; it or an earlier range covers point if the running max end is past it
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if RANGE.unpack_from(self._map, offset + mid * RANGE.size)[0] <= point:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo > 0 and RANGE.unpack_from(self._map, offset + (lo - 1) * RANGE.size)[2] > point
+
+    def _ranges(self, room_number):
+        idx = self._find('rooms', ROOM, room_number)
+        if idx is None:
+            return []
+
+        _, _, _, _, first, count = self._unpack('rooms', ROOM, idx)
+        offset = self._sections['ranges'][0] + first * RANGE.size
+        return [RANGE.unpack_from(self._map, offset + i * RANGE.size) for i in range(count)]
+
+    def _find(self, section, record, key):
+        """Returns the position of the record whose first field is key in a section sorted by it, or None"""
+        offset, count = self._sections[section]
+        lo, hi = 0, count
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = record.unpack_from(self._map, offset + mid * record.size)[0]
+            if value == key:
+                return mid
+            if value < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return None
+
+    def _unpack(self, section, record, idx):
+        return record.unpack_from(self._map, self._sections[section][0] + idx * record.size)
+
+    def _room_record(self, idx):
+        number, type_idx, rate, version, _, _ = self._unpack('rooms', ROOM, idx)
+        return RoomRecord(number, self._types[type_idx], rate, version)
+
+    @staticmethod
+    def _stay_record(values):
+        stay_id, room_number, guest_id, start, end, checked_in = values
+        return StayRecord(stay_id, room_number, None if guest_id < 0 else guest_id,
+                          _datetime(start), _datetime(end), checked_in)
+
+    @staticmethod
+    def _schedule_record(values):
+        schedule_id, employee_id, week_start, scheduled, worked, clocked_in = values
+        return ScheduleRecord(schedule_id, None if employee_id is None or employee_id < 0 else employee_id,
+                              date.fromordinal(week_start), scheduled, worked, clocked_in)
+
+def _micros(value):
+    return (value - EPOCH) // MICROSECOND
+
+def _datetime(micros):
+    return EPOCH + micros * MICROSECOND
+
+def _or_none(value):
+    return -1 if value is None else value
+
+def test():
+    import tempfile
+    from time import perf_counter
+    from base import Base
+    from person import Employee
+    from utils import get_session, dispose_engines
+
+    folder = tempfile.mkdtemp()
+    db_path = os.path.join(folder, 'hotel.db')
+    path = os.path.join(folder, 'hotel.snapshot')
+    session = get_session(path=db_path)
+
+    rooms = []
+    for num in range(1, 5001):
+        room = Room(num, 'queen' if num % 2 else 'king', 100)
+        for week in range(20):
+            start = datetime(2023, 1, 2) + timedelta(weeks=week)
+            room.add_unavailable(start, start + timedelta(days=3))
+        rooms.append(room)
+    Base.save_all(rooms, session, bulk=True)
+    Base.save_all([block for room in rooms for block in room._unavailable], session, bulk=True)
+
+    guest = Guest(Account(), 'Mike', 'snapshot@email.com')
+    employee = Employee(20, 'Julian', 'snapshot-employee@email.com')
+    employee.add_schedule(Schedule(date(2022, 12, 29)))
+    Base.save_all([guest, employee], session)
+    guest_id = guest._id
+    print(write_snapshot(session, path, datetime(2023, 1, 1)))   # -> 105002
+    session.close()
+
+    # Changes made after the snapshot are picked up by replay
+    session = get_session(path=db_path)
+    guest = session.get(Guest, guest_id)
+    guest.book_stay(Stay(session.get(Room, 7), datetime(2023, 6, 1), datetime(2023, 6, 3)))
+    session.commit()
+
+    began = perf_counter()
+    snapshot = Snapshot(path)
+    print(snapshot.replay(session))                              # -> 1
+    warm = perf_counter() - began
+
+    print(snapshot.available_on(8, datetime(2023, 1, 3)), snapshot.available_on(8, datetime(2023, 1, 5)))  # -> False True
+    print(snapshot.available_on(7, datetime(2023, 6, 2)))        # -> False
+    print(snapshot.get_account(guest.get_account()._id).total_due_cents)  # -> 20000
+    print(len(snapshot.get_stays()), len(snapshot.get_room_numbers()))     # -> 1 5000
+
+    # A bulk rate change and a check-in (which moves the stay start to now) both bump
+    # the versions of the rooms they touch
+    Room.set_type_rate('queen', 55, session)
+    session.scalars(select(Stay)).one().check_in()
+    session.commit()
+    print(snapshot.replay(session), snapshot.get_room(1).rate, snapshot.get_room(2).rate)  # -> 2500 55.0 100.0
+    print(snapshot.get_stays()[0].checked_in, snapshot.available_on(7, datetime(2023, 6, 2)))  # -> True True
+    print(len(snapshot.get_schedules()))                        # -> 1
+    snapshot.close()
+    session.close()
+
+    session = get_session(path=db_path)
+    began = perf_counter()
+    for room in Room.get_all(session):
+        room.available_on(datetime(2023, 1, 3))
+    cold = perf_counter() - began
+    print(warm < 1, warm < cold)                                 # -> True True
+
+    session.close()
+    dispose_engines()
+
+if __name__ == '__main__': test()
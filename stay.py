@@ -2,10 +2,14 @@
 # Stay class
 
 from datetime import datetime
-from sqlalchemy import ForeignKey
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from threading import Lock
+from sqlalchemy import ForeignKey, Index, event
+from sqlalchemy.orm import Mapped, mapped_column, relationship, object_session, Session
 from base import Base
-from room import Room
+from room import Room, Unavailability
+
+class RoomUnavailableError(Exception):
+    """Raised when a stay is set up in a room that is not available on its dates"""
 
 class Stay(Base):
     """Stay class for hotel management system"""
@@ -21,10 +25,14 @@ class Stay(Base):
         self._setup_room(room)
 
     __tablename__ = 'stay'
+    __table_args__ = (
+        Index('ix_stay_guest_room_start', '_guest_id', '_room_number', '_start'),
+    )
 
     _id: Mapped[int] = mapped_column(primary_key=True)
     _room_number: Mapped[int] = mapped_column(ForeignKey('room._room_number'))
     _room: Mapped[Room] = relationship()
+    _unavailability: Mapped[Unavailability] = relationship()
     _start: Mapped[datetime]
     _end: Mapped[datetime]
     _checked_in: Mapped[bool]
@@ -32,9 +40,33 @@ class Stay(Base):
     _replacement_keycards: Mapped[int]
     _guest_id: Mapped[int] = mapped_column(ForeignKey('person._id'), nullable=True)
 
+    # Objects notified with room_booked / room_released when a stay changes room availability.
+    # The list is replaced rather than changed in place, so it can be read without the lock.
+    _observers = []
+    _observers_lock = Lock()
+
+    @classmethod
+    def add_observer(cls, observer):
+        with cls._observers_lock:
+            Stay._observers = Stay._observers + [observer]
+
+    @classmethod
+    def remove_observer(cls, observer):
+        with cls._observers_lock:
+            observers = list(Stay._observers)
+            observers.remove(observer)
+            Stay._observers = observers
+
     def get_room(self):
         return self._room
     
+    def get_room_number(self):
+        """Returns the number of the stay's room without loading the Room when possible"""
+        if self._room_number is not None:
+            return self._room_number
+        
+        return self.get_room().get_room_number()
+    
     def get_start(self):
         return self._start
     
@@ -68,16 +100,32 @@ class Stay(Base):
     def reset_room(self):
         room = self.get_room()
         room.remove_unavailable(self.get_start())
+        self._unavailability = None
+        self._notify('room_released', room, self.get_start(), self.get_end())
 
     def _setup_room(self, room):
         start = self.get_start()
         end = self.get_end()
 
         if not room.available_on(start, end):
-            raise Exception('Room instance is not available on specified dates')
+            raise RoomUnavailableError('Room instance is not available on specified dates')
 
         self._room = room
-        room.add_unavailable(start, end)
+        self._room_number = room.get_room_number()
+        self._unavailability = room.add_unavailable(start, end)
+        self._notify('room_booked', room, start, end)
+
+    def _notify(self, name, room, start, end):
+        """
+        Calls name(room, start, end) on the observers once the session of the room
+        commits, or right away if the room is not in a session. Notifications
+        queued in a session are dropped if it rolls back or is closed.
+        """
+        session = object_session(room)
+        if session is None:
+            _deliver([(name, room, start, end)])
+        else:
+            session.info.setdefault('stay_notifications', []).append((name, room, start, end))
 
     def num_nights(self):
         return (self.get_end() - self.get_start()).days
@@ -95,7 +143,10 @@ class Stay(Base):
         if not self.is_checked_in(): return False
         
         self._checked_in = False
-        self._end = datetime.now()
+        end, self._end = self._end, datetime.now()
+
+        # The room keeps its range, but the nights charged for the stay change
+        self._notify('room_released', self.get_room(), min(end, self._end), max(end, self._end))
         return True
     
     def is_checked_in(self):
@@ -123,6 +174,24 @@ class Stay(Base):
         end_date = self.get_end().date()
         return f'<Stay: Room {room_number}, {start_date} to {end_date}>'
     
+def _deliver(notifications):
+    observers = Stay._observers
+    for name, room, start, end in notifications:
+        for observer in observers:
+            getattr(observer, name)(room, start, end)
+
+@event.listens_for(Session, 'after_commit')
+def _deliver_notifications(session):
+    notifications = session.info.pop('stay_notifications', None)
+    if notifications:
+        _deliver(notifications)
+
+@event.listens_for(Session, 'after_transaction_end')
+def _discard_notifications(session, transaction):
+    # Covers rollbacks and sessions closed without committing
+    if transaction.parent is None:
+        session.info.pop('stay_notifications', None)
+
 def test():
     from utils import future_datetime
 
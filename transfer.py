@@ -0,0 +1,344 @@
+# SWDV 630 - Object-Oriented Software Architecture
+# Streaming bulk import and export of rooms, guests and stays
+
+import csv
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+from itertools import groupby, islice
+from operator import itemgetter
+from time import perf_counter
+from sqlalchemy import select, insert, update
+from account import Account
+from availability import IntervalIndex
+from base import Base
+from factory import PersonFactory
+from person import Guest
+from room import Room, Unavailability
+from stay import Stay
+
+ROOM_FIELDS = ['room_number', 'type', 'rate']
+GUEST_FIELDS = ['name', 'email', 'joined']
+STAY_FIELDS = ['guest_email', 'room_number', 'start', 'end']
+
+ImportResult = namedtuple('ImportResult', 'imported rejected errors seconds rows_per_sec')
+
+def read_records(path):
+    """Yields (line number, dict) for each record of a .csv (with a header row) or .jsonl file"""
+    with open(path, newline='') as file:
+        if path.endswith('.jsonl'):
+            for line_no, line in enumerate(file, 1):
+                if line.strip():
+                    yield line_no, json.loads(line)
+        else:
+            for line_no, record in enumerate(csv.DictReader(file), 2):
+                yield line_no, record
+
+def write_records(path, fields, rows):
+    """Writes rows (sequences in the order of fields) to a .csv or .jsonl file and returns the number written"""
+    count = 0
+    with open(path, 'w', newline='') as file:
+        if path.endswith('.jsonl'):
+            for row in rows:
+                file.write(json.dumps(dict(zip(fields, map(_plain, row)))) + '\n')
+                count += 1
+        else:
+            writer = csv.writer(file)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(map(_plain, row))
+                count += 1
+
+    return count
+
+def export_rooms(session, path, chunk_size=1000):
+    rows = Room.project(session, '_room_number', '_type', '_rate', order_by='_room_number', chunk_size=chunk_size)
+    return write_records(path, ROOM_FIELDS, rows)
+
+def export_guests(session, path, chunk_size=1000):
+    rows = Guest.project(session, '_name', '_email', '_joined', order_by='_id', chunk_size=chunk_size)
+    return write_records(path, GUEST_FIELDS, rows)
+
+def export_stays(session, path, chunk_size=1000):
+    stmt = select(Guest._email, Stay._room_number, Stay._start, Stay._end).join(
+        Guest, Guest._id == Stay._guest_id).order_by(Stay._id)
+    result = session.execute(stmt, execution_options={'yield_per': chunk_size})
+    return write_records(path, STAY_FIELDS, (row for chunk in result.partitions() for row in chunk))
+
+def import_rooms(session, path, chunk_size=1000, checkpoint=None, progress=None):
+    """Imports rooms (room_number, type, rate), rejecting room numbers that already exist"""
+    return _run_import(session, path, _parse_room, _write_rooms, chunk_size, checkpoint, progress)
+
+def import_guests(session, path, chunk_size=1000, checkpoint=None, progress=None):
+    """Imports guests (name, email and optional joined) with empty accounts, rejecting emails already in use"""
+    return _run_import(session, path, _parse_guest, _write_guests, chunk_size, checkpoint, progress)
+
+def import_stays(session, path, chunk_size=1000, checkpoint=None, progress=None):
+    """
+    Imports stays (guest_email, room_number, start, end) for existing guests and
+    rooms. Every stay of a known guest and room is first checked against the
+    rooms' existing unavailable ranges and the other such stays in the file with
+    find_conflicts, and conflicting stays are rejected. Accounts are not charged
+    for imported stays.
+    """
+    skip = _load_checkpoint(checkpoint, path)
+    known = _known_stays(session, _parsed(path, _parse_stay, skip), chunk_size)
+    ranges = [(line_no, stay[1], stay[2], stay[3]) for line_no, stay in known]
+
+    stmt = select(Unavailability._room_number, Unavailability._start, Unavailability._end).order_by(
+        Unavailability._room_number, Unavailability._start)
+    existing = session.execute(stmt, execution_options={'yield_per': chunk_size})
+    conflicts = find_conflicts(ranges, (row for chunk in existing.partitions() for row in chunk))
+
+    def write(session, rows):
+        rejected = [(line_no, conflicts[line_no]) for line_no, _ in rows if line_no in conflicts]
+        rows = [(line_no, stay) for line_no, stay in rows if line_no not in conflicts]
+        return rejected + _write_stays(session, rows)
+
+    return _run_import(session, path, _parse_stay, write, chunk_size, checkpoint, progress)
+
+def find_conflicts(ranges, existing):
+    """
+    Returns a dict of line number -> reason for the ranges that can't be booked,
+    using a sort-based sweep over each room. ranges yields (line number, room
+    number, start, end) and existing yields (room number, start, end) sorted by
+    room number and start.
+
+    A range conflicts with an existing one under the same rule as
+    Room.available_on (its start or end falls inside it). Between the ranges
+    being imported, the one that starts first is kept, and a later one conflicts
+    if it starts before an earlier kept one ends.
+    """
+    conflicts = {}
+    existing = iter(existing)
+    blocked = next(existing, None)
+
+    for room_number, group in groupby(sorted(ranges, key=itemgetter(1, 2, 0)), key=itemgetter(1)):
+        while blocked is not None and blocked[0] < room_number:
+            blocked = next(existing, None)
+
+        index = IntervalIndex()
+        while blocked is not None and blocked[0] == room_number:
+            index.add(blocked[1], blocked[2])
+            blocked = next(existing, None)
+
+        kept_until = None
+        for line_no, _, start, end in group:
+            if end < start:
+                conflicts[line_no] = 'ends before it starts'
+            elif index.covers(start) or index.covers(end):
+                conflicts[line_no] = f'room {room_number} is unavailable'
+            elif kept_until is not None and start < kept_until:
+                conflicts[line_no] = f'overlaps another stay in room {room_number}'
+            else:
+                kept_until = end if kept_until is None else max(kept_until, end)
+
+    return conflicts
+
+def _known_stays(session, stays, chunk_size):
+    """Yields the (line number, stay) pairs whose guest and room exist, looking them up chunk_size at a time"""
+    stays = iter(stays)
+    while True:
+        chunk = list(islice(stays, chunk_size))
+        if not chunk: break
+
+        emails = {stay[0] for _, stay in chunk}
+        numbers = {stay[1] for _, stay in chunk}
+        guests = set(session.scalars(select(Guest._email).where(Guest._email.in_(emails))))
+        rooms = set(session.scalars(select(Room._room_number).where(Room._room_number.in_(numbers))))
+
+        for line_no, stay in chunk:
+            if stay[0] in guests and stay[1] in rooms:
+                yield line_no, stay
+
+def _run_import(session, path, parse, write, chunk_size, checkpoint, progress):
+    """
+    Reads records from path in chunks of chunk_size, writing and committing each
+    chunk and then recording the last line done in the checkpoint file (if any),
+    so a failed import can be run again and pick up after the last committed
+    chunk. progress(stats) is called after every chunk with a dict of the line,
+    rows imported and rejected so far, elapsed seconds and rows per second.
+    """
+    began = perf_counter()
+    skip = _load_checkpoint(checkpoint, path)
+    imported = 0
+    errors = []
+    records = _parsed(path, parse, skip, errors)
+
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk: break
+
+        rejected = write(session, chunk)
+        session.commit()
+        _save_checkpoint(checkpoint, path, chunk[-1][0])
+
+        errors.extend(rejected)
+        imported += len(chunk) - len(rejected)
+
+        if progress:
+            seconds = perf_counter() - began
+            progress({'line': chunk[-1][0], 'imported': imported, 'rejected': len(errors),
+                      'seconds': seconds, 'rows_per_sec': imported / seconds if seconds else 0.0})
+
+    seconds = perf_counter() - began
+    return ImportResult(imported, len(errors), sorted(errors), seconds, imported / seconds if seconds else 0.0)
+
+def _parsed(path, parse, skip=0, errors=None):
+    """Yields (line number, parsed record) after line skip, adding unparsable records to errors"""
+    for line_no, record in read_records(path):
+        if line_no <= skip: continue
+
+        try:
+            yield line_no, parse(record)
+        except (KeyError, TypeError, ValueError) as err:
+            if errors is not None:
+                errors.append((line_no, f'invalid record: {err!r}'))
+
+def _parse_room(record):
+    return int(record['room_number']), record['type'], float(record['rate'])
+
+def _parse_guest(record):
+    joined = record.get('joined')
+    return record['name'], record['email'], datetime.fromisoformat(joined) if joined else None
+
+def _parse_stay(record):
+    return (record['guest_email'], int(record['room_number']),
+            datetime.fromisoformat(record['start']), datetime.fromisoformat(record['end']))
+
+def _write_rooms(session, rows):
+    numbers = [room[0] for _, room in rows]
+    existing = set(session.scalars(select(Room._room_number).where(Room._room_number.in_(numbers))))
+    rejected = []
+    rooms = []
+
+    for line_no, (number, type, rate) in rows:
+        if number in existing:
+            rejected.append((line_no, f'room {number} already exists'))
+        else:
+            existing.add(number)
+            rooms.append(Room(number, type, rate))
+
+    Base.save_all(rooms, session, bulk=True, batch_size=len(rows))
+    return rejected
+
+def _write_guests(session, rows):
+    emails = [guest[1] for _, guest in rows]
+    existing = set(session.scalars(select(Guest._email).where(Guest._email.in_(emails))))
+    rejected = []
+    accounts = []
+    guests = []
+
+    for line_no, (name, email, joined) in rows:
+        if email in existing:
+            rejected.append((line_no, f'email {email} is already in use'))
+            continue
+
+        existing.add(email)
+        account = Account()
+        extra = {'joined': joined} if joined else {}
+        accounts.append(account)
+        guests.append(PersonFactory.create('guest', account, name, email, **extra))
+
+    Base.save_all(accounts + guests, session, bulk=True, batch_size=len(rows))
+    return rejected
+
+def _write_stays(session, rows):
+    """Inserts stays with their unavailable ranges, using RETURNING to link the two, and bumps the rooms' versions"""
+    emails = {stay[0] for _, stay in rows}
+    numbers = {stay[1] for _, stay in rows}
+    guest_ids = dict(session.execute(select(Guest._email, Guest._id).where(Guest._email.in_(emails))).all())
+    rooms = set(session.scalars(select(Room._room_number).where(Room._room_number.in_(numbers))))
+    rejected = []
+    stays = []
+
+    for line_no, (email, number, start, end) in rows:
+        if email not in guest_ids:
+            rejected.append((line_no, f'unknown guest {email}'))
+        elif number not in rooms:
+            rejected.append((line_no, f'unknown room {number}'))
+        else:
+            stays.append((guest_ids[email], number, start, end))
+
+    if not stays:
+        return rejected
+
+    params = [{'_guest_id': guest_id, '_room_number': number, '_start': start, '_end': end, '_checked_in': False,
+               '_remaining_keycards': 2, '_replacement_keycards': 0} for guest_id, number, start, end in stays]
+    stmt = insert(Stay).returning(Stay._id, sort_by_parameter_order=True)
+    stay_ids = session.scalars(stmt, params).all()
+
+    session.execute(insert(Unavailability), [
+        {'_room_number': number, '_start': start, '_end': end, '_stay_id': stay_id}
+        for stay_id, (_, number, start, end) in zip(stay_ids, stays)
+    ])
+
+    # Changing a room's availability outside the ORM must still fail concurrent optimistic bookings
+    stmt = update(Room).where(Room._room_number.in_({stay[1] for stay in stays})).values(_version=Room._version + 1)
+    session.execute(stmt, execution_options={'synchronize_session': 'fetch'})
+    return rejected
+
+def _load_checkpoint(checkpoint, source):
+    """Returns the last line of source recorded as done in the checkpoint file, or 0"""
+    if not checkpoint or not os.path.exists(checkpoint):
+        return 0
+
+    with open(checkpoint) as file:
+        done = json.load(file)
+
+    return done['line'] if done.get('source') == os.path.abspath(source) else 0
+
+def _save_checkpoint(checkpoint, source, line):
+    if not checkpoint: return
+
+    temp_path = checkpoint + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump({'source': os.path.abspath(source), 'line': line}, file)
+    os.replace(temp_path, checkpoint)
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def test():
+    import tempfile
+    from utils import get_session
+
+    folder = tempfile.mkdtemp()
+    rooms_csv = os.path.join(folder, 'rooms.csv')
+    guests_jsonl = os.path.join(folder, 'guests.jsonl')
+    stays_csv = os.path.join(folder, 'stays.csv')
+
+    write_records(rooms_csv, ROOM_FIELDS, [(num, 'queen', 100) for num in range(1, 6)] + [(1, 'king', 150)])
+    write_records(guests_jsonl, GUEST_FIELDS, [(f'Guest {num}', f'import{num}@email.com', None) for num in range(1, 6)])
+    write_records(stays_csv, STAY_FIELDS, [
+        ('import1@email.com', 1, datetime(2023, 8, 1), datetime(2023, 8, 4)),
+        ('import2@email.com', 1, datetime(2023, 8, 3), datetime(2023, 8, 6)),     # overlaps the first stay
+        ('import3@email.com', 2, datetime(2023, 8, 1), datetime(2023, 8, 4)),
+        ('import4@email.com', 3, datetime(2023, 8, 1), datetime(2023, 8, 4)),
+        ('nobody@email.com', 4, datetime(2023, 8, 1), datetime(2023, 8, 4)),
+        ('import5@email.com', 5, datetime(2023, 8, 1), datetime(2023, 8, 4)),
+        ('import2@email.com', 4, datetime(2023, 8, 3), datetime(2023, 8, 6)),     # overlaps only the rejected stay
+    ])
+
+    session = get_session()
+    print(import_rooms(session, rooms_csv).errors)     # -> [(7, 'room 1 already exists')]
+    print(import_guests(session, guests_jsonl).imported)  # -> 5
+
+    # Fail after the first chunk, then resume from the checkpoint
+    checkpoint = os.path.join(folder, 'stays.checkpoint')
+    def fail(stats): raise RuntimeError(stats)
+    try:
+        import_stays(session, stays_csv, chunk_size=2, checkpoint=checkpoint, progress=fail)
+    except RuntimeError as err:
+        print(err.args[0]['line'], err.args[0]['imported'])  # -> 3 1
+
+    result = import_stays(session, stays_csv, chunk_size=2, checkpoint=checkpoint)
+    print(result.imported, result.errors)      # -> 4 [(6, 'unknown guest nobody@email.com')]
+    print(session.get(Room, 2).available_on(datetime(2023, 8, 2)))  # -> False
+
+    print(session.get(Room, 4).available_on(datetime(2023, 8, 4)))  # -> False
+    print(export_stays(session, os.path.join(folder, 'export.jsonl')))  # -> 5
+    session.close()
+
+if __name__ == '__main__': test()
@@ -2,15 +2,109 @@
 # Utility functions
 
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from threading import Lock
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
+from sqlalchemy.pool import StaticPool
 from base import Base
 
-def get_session(echo=False):
-    #engine = create_engine("sqlite+pysqlite:///test.db", echo=echo)
-    engine = create_engine("sqlite+pysqlite:///:memory:", echo=echo)
-    Base.metadata.create_all(engine)
-    return Session(engine)
+# Pragmas applied to every connection of a file-backed SQLite database
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,    # negative values are in KiB
+    'busy_timeout': 30000,
+}
+
+_engines = {}
+_factories = {}
+_table_counts = {}
+_lock = Lock()
+
+def get_engine(path=None, echo=False, pragmas=None, shared=False, **pool_options):
+    """
+    Returns the process-wide engine for the SQLite database at path. Without a
+    path, returns a new engine on an empty in-memory database, or the process-wide
+    in-memory engine if shared is True. Shared engines and their schema are created
+    on first use only; echo, pragmas and pool options (e.g. pool_size, max_overflow)
+    apply when the engine is created. pragmas are merged over SQLITE_PRAGMAS for
+    file-backed databases.
+    """
+    if not path and not shared:
+        engine = create_engine('sqlite+pysqlite:///:memory:', echo=echo)
+        Base.metadata.create_all(engine)
+        return engine
+
+    url = f'sqlite+pysqlite:///{path}' if path else 'sqlite+pysqlite:///:memory:'
+
+    with _lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = _create_engine(url, path, echo, pragmas, pool_options)
+            _engines[url] = engine
+
+        # Create the schema once, and again only if more mapped classes were imported since
+        if _table_counts.get(url) != len(Base.metadata.tables):
+            Base.metadata.create_all(engine)
+            _table_counts[url] = len(Base.metadata.tables)
+
+        return engine
+
+def _create_engine(url, path, echo, pragmas, pool_options):
+    if path:
+        engine = create_engine(url, echo=echo, connect_args={'check_same_thread': False}, **pool_options)
+        settings = {**SQLITE_PRAGMAS, **(pragmas or {})}
+        event.listen(engine, 'connect', lambda conn, record: _apply_pragmas(conn, settings))
+        return engine
+
+    # A single connection for the whole process, so every session sees the same
+    # in-memory database. Only use it from one thread at a time.
+    return create_engine(url, echo=echo, poolclass=StaticPool, connect_args={'check_same_thread': False})
+
+def get_session_factory(path, echo=False, **options):
+    """
+    Returns a thread-local scoped_session registry bound to the shared engine for
+    the database file at path. A file is required so each thread gets its own connection.
+    """
+    if not path:
+        raise ValueError('A database file path is required for a session factory')
+
+    engine = get_engine(path, echo, **options)
+
+    with _lock:
+        factory = _factories.get(engine)
+        if factory is None:
+            factory = scoped_session(sessionmaker(bind=engine))
+            _factories[engine] = factory
+
+        return factory
+
+def get_session(echo=False, path=None, shared=False):
+    """
+    Returns a new Session on the shared engine for path, or on a new empty
+    in-memory database if path is None (the shared one if shared is True)
+    """
+    return Session(get_engine(path, echo, shared=shared))
+
+def dispose_engines():
+    """Closes every shared engine and clears the registry"""
+    with _lock:
+        for factory in _factories.values():
+            factory.remove()
+
+        for engine in _engines.values():
+            engine.dispose()
+
+        _factories.clear()
+        _engines.clear()
+        _table_counts.clear()
+
+def _apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
 
 def future_datetime(days=0, hours=0):
     return datetime.now() + timedelta(days=days, hours=hours)